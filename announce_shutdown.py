@@ -1,17 +1,30 @@
 #!/usr/bin/env python3
 import sys
+import os
+import queue
+import re
 import smtplib
+import socket
+import threading
 import time
 from email.message import EmailMessage
+from email.policy import SMTP
 
 # Import from your existing codebase
 sys.path.append('/home/sij/hand_of_morpheus')
-from sw1tch import config, load_registrations
+from sw1tch import DATA_DIR, config, cached_registrations, index_registrations
 
 # --- CONFIGURATION ---
 SHUTDOWN_DATE = "January 22, 2026"
 SUBJECT = f"IMPORTANT: {config['homeserver']} Server Shutdown Notice"
-DELAY_SECONDS = 10  # Slow down to keep the mail server happy
+MESSAGES_PER_MINUTE = 6  # Slow down to keep the mail server happy
+MAX_ATTEMPTS = 3  # Retries per recipient when the server answers with a 4xx
+WORKERS = 4  # Concurrent SMTP connections sharing the rate limit
+IDLE_PROBE_SECONDS = 120  # NOOP the connection before use if it has been quiet this long
+MAX_PER_CONN = 1000  # Reconnect after this many messages; providers cap messages per session
+SENT_LOG_PATH = os.path.join(DATA_DIR, "announcement_sent.log")  # One address per line, appended as we go
+PLACEHOLDER_EMAIL = "null@nope.no"  # Used for retroactively documented users
+TO_PLACEHOLDER = "__TO__"  # Stands in for the recipient in the pre-serialized message
 
 # Emails that already received the message (copied from your logs)
 SKIP_EMAILS = {
@@ -37,6 +50,19 @@ SKIP_EMAILS = {
     "Onetwo421@proton.me"
 }
 
+def normalize_email(addr: str) -> str:
+    return addr.strip().lower()
+
+def load_sent_log() -> set:
+    """Addresses recorded as sent by a previous run."""
+    try:
+        with open(SENT_LOG_PATH, "r") as f:
+            return {normalize_email(line) for line in f if line.strip()}
+    except FileNotFoundError:
+        return set()
+
+SKIP = frozenset(normalize_email(e) for e in SKIP_EMAILS) | load_sent_log()
+
 BODY = f"""
 Hello,
 
@@ -60,60 +86,271 @@ Regards,
 {config['homeserver']} Administration
 """
 
+class RateLimiter:
+    """Leaky bucket pacing sends to a steady rate.
+
+    A 4xx reply doubles the interval; each successful send eases it back toward the base rate.
+    """
+
+    def __init__(self, per_minute: float):
+        self.base_interval = 60.0 / per_minute
+        self.interval = self.base_interval
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def back_off(self):
+        with self.lock:
+            self.interval = min(self.interval * 2, 300.0)
+        print(f"Server pushed back, slowing to one message every {self.interval:.0f}s.")
+
+    def recover(self):
+        with self.lock:
+            self.interval = max(self.interval * 0.8, self.base_interval)
+
+def _dot_stuff(payload: bytes) -> bytes:
+    """Escape leading dots and append the end-of-data marker (RFC 5321 4.5.2)."""
+    payload = re.sub(rb"(?m)^\.", b"..", payload)
+    if not payload.endswith(b"\r\n"):
+        payload += b"\r\n"
+    return payload + b".\r\n"
+
+def deliver(server, sender, recipient, payload):
+    """Send one message and return the server's (code, reply) for it.
+
+    When the server advertises PIPELINING (RFC 2920), MAIL FROM, RCPT TO and DATA
+    go out in a single write and their replies are drained afterwards, so each
+    message costs two round trips instead of four.
+    """
+    if not server.has_extn("pipelining"):
+        try:
+            server.sendmail(sender, [recipient], payload)
+            return 250, b"OK"
+        except smtplib.SMTPRecipientsRefused as e:
+            return e.recipients[recipient]
+        except smtplib.SMTPResponseException as e:
+            return e.smtp_code, e.smtp_error
+
+    server.send(f"MAIL FROM:{smtplib.quoteaddr(sender)}\r\n"
+                f"RCPT TO:{smtplib.quoteaddr(recipient)}\r\n"
+                "DATA\r\n")
+    mail_reply, rcpt_reply, data_reply = (server.getreply() for _ in range(3))
+    failed = next((r for r in (mail_reply, rcpt_reply) if r[0] >= 400), None)
+    if data_reply[0] == 354:
+        if failed:
+            # Some servers open DATA even without a valid recipient; close it empty.
+            server.send(b".\r\n")
+            server.getreply()
+        else:
+            server.send(_dot_stuff(payload))
+            return server.getreply()
+    server.rset()
+    return failed or data_reply
+
+class SmtpUnavailable(Exception):
+    """Raised once reconnecting has been retried and the server still cannot be reached."""
+
+class SmtpSession:
+    """SMTP connection that survives drops: probes idle links with NOOP and reconnects on failure."""
+
+    def __init__(self, smtp_conf):
+        self.conf = smtp_conf
+        self.server = None
+        self.last_ok_ts = 0.0
+        self.sent_on_conn = 0
+
+    def __enter__(self):
+        if self.server is None:
+            self.connect()
+        return self
+
+    def __exit__(self, *exc):
+        self._close()
+
+    def connect(self):
+        self._close()
+        server = smtplib.SMTP(self.conf["host"], self.conf["port"], timeout=60)
+        if self.conf.get("use_tls", True):
+            server.starttls()
+        server.login(self.conf["username"], self.conf["password"])
+        server.ehlo()
+        self.server = server
+        self.last_ok_ts = time.monotonic()
+        self.sent_on_conn = 0
+
+    def _close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                self.server.close()
+            self.server = None
+
+    def _reconnect(self):
+        for attempt in range(3):
+            try:
+                self.connect()
+                print("Reconnected to SMTP server.")
+                return
+            except (smtplib.SMTPException, OSError) as e:
+                delay = 2 ** (attempt + 1)
+                print(f"Reconnect failed ({e}), retrying in {delay}s...")
+                time.sleep(delay)
+        try:
+            self.connect()
+        except (smtplib.SMTPException, OSError) as e:
+            raise SmtpUnavailable(f"Could not reconnect to SMTP server: {e}") from e
+
+    def _probe(self):
+        if time.monotonic() - self.last_ok_ts <= IDLE_PROBE_SECONDS:
+            return
+        if self.server is None or self.server.sock is None:
+            self._reconnect()
+            return
+        self.server.sock.settimeout(10)
+        try:
+            if self.server.noop()[0] != 250:
+                raise smtplib.SMTPServerDisconnected("NOOP rejected")
+        except (smtplib.SMTPException, OSError):
+            self._reconnect()
+        finally:
+            if self.server is not None and self.server.sock:
+                self.server.sock.settimeout(60)
+
+    @property
+    def pipelining(self):
+        return self.server.has_extn("pipelining")
+
+    def send(self, sender, recipient, payload):
+        """Deliver one message, reconnecting and retrying if the connection has gone away."""
+        for attempt in range(3):
+            try:
+                if self.server is None or self.sent_on_conn >= MAX_PER_CONN:
+                    self._reconnect()
+                self._probe()
+                code, reply = deliver(self.server, sender, recipient, payload)
+                if code == 421:  # Service closing transmission channel
+                    raise smtplib.SMTPServerDisconnected(reply)
+                self.last_ok_ts = time.monotonic()
+                self.sent_on_conn += 1
+                return code, reply
+            except (smtplib.SMTPServerDisconnected, socket.timeout, ConnectionError) as e:
+                print(f"SMTP connection lost ({e}), reconnecting...")
+                time.sleep(2 ** attempt)
+                self._reconnect()
+        return deliver(self.server, sender, recipient, payload)
+
 def send_announcement():
-    registrations = load_registrations()
+    registrations = cached_registrations()
     print(f"Loaded {len(registrations)} registrations.")
     
     smtp_conf = config["email"]["smtp"]
     
-    try:
-        server = smtplib.SMTP(smtp_conf["host"], smtp_conf["port"])
-        if smtp_conf.get("use_tls", True):
-            server.starttls()
-        server.login(smtp_conf["username"], smtp_conf["password"])
-        print("SMTP Connection successful.")
-    except Exception as e:
-        print(f"SMTP Failed: {e}")
-        return
-
     count = 0
     skipped = 0
+    worklist = []
+
+    # The message is identical for everyone except the To: header, so serialize it once
+    # and patch the address into the bytes per recipient
+    template_msg = EmailMessage()
+    template_msg.set_content(BODY)
+    template_msg["Subject"] = SUBJECT
+    template_msg["From"] = smtp_conf["from"]
+    template_msg["To"] = TO_PLACEHOLDER
+    template = template_msg.as_bytes(policy=SMTP)
     
-    for user in registrations:
-        email_addr = user.get('email')
-        username = user.get('requested_name')
+    # One message per address, however many accounts were registered with it
+    by_email, _ = index_registrations(registrations)
+    for key, users in by_email.items():
+        email_addr = users[0]['email'].strip()
+        username = ", ".join(user.get('requested_name') or '?' for user in users)
         
-        # Skip invalid or already sent emails
-        if not email_addr or "null@nope.no" in email_addr:
+        # Skip placeholder or already sent emails
+        if key == PLACEHOLDER_EMAIL:
             continue
-            
-        if email_addr in SKIP_EMAILS:
+        if key in SKIP:
             skipped += 1
             continue
             
-        msg = EmailMessage()
-        msg.set_content(BODY)
-        msg["Subject"] = SUBJECT
-        msg["From"] = smtp_conf["from"]
-        msg["To"] = email_addr
-        
         try:
-            server.send_message(msg)
-            print(f"[{count+1}] Sent to {username} ({email_addr})")
-            count += 1
-            # Wait to avoid rate limits
-            time.sleep(DELAY_SECONDS)
-        except Exception as e:
-            print(f"FAILED to send to {email_addr}: {e}")
-            # If connection dropped, try to reconnect? 
-            # For simplicity, we just print fail. You can re-run script adding this email to SKIP list.
-
-    server.quit()
+            payload = template.replace(TO_PLACEHOLDER.encode("ascii"), email_addr.encode("ascii"), 1)
+        except UnicodeEncodeError:
+            # Internationalized addresses need proper header encoding
+            msg = EmailMessage()
+            msg.set_content(BODY)
+            msg["Subject"] = SUBJECT
+            msg["From"] = smtp_conf["from"]
+            msg["To"] = email_addr
+            payload = msg.as_bytes(policy=SMTP)
+        worklist.append((username, email_addr, payload))
+
+    jobs = queue.Queue()
+    for job in worklist:
+        jobs.put(job)
+    limiter = RateLimiter(MESSAGES_PER_MINUTE)
+    lock = threading.Lock()
+
+    with open(SENT_LOG_PATH, "a", buffering=1) as sent_log:
+        def worker(n):
+            nonlocal count
+            session = SmtpSession(smtp_conf)
+            try:
+                session.connect()
+                print(f"[worker {n}] SMTP Connection successful (pipelining: {'yes' if session.pipelining else 'no'}).")
+            except Exception as e:
+                print(f"[worker {n}] SMTP Failed: {e}")
+                return
+            with session:
+                while True:
+                    try:
+                        job = jobs.get_nowait()
+                    except queue.Empty:
+                        return
+                    username, email_addr, payload = job
+                    try:
+                        for attempt in range(MAX_ATTEMPTS):
+                            limiter.wait()
+                            code, reply = session.send(smtp_conf["from"], email_addr, payload)
+                            if not 400 <= code < 500:
+                                break
+                            limiter.back_off()
+                        if code < 400:
+                            limiter.recover()
+                            with lock:
+                                count += 1
+                                print(f"[{count}] Sent to {username} ({email_addr})")
+                                sent_log.write(normalize_email(email_addr) + "\n")
+                        else:
+                            print(f"FAILED to send to {email_addr}: {code} {reply.decode(errors='replace')}")
+                    except SmtpUnavailable as e:
+                        # Leave the job for another worker (or the next run) instead of
+                        # failing every remaining message against a dead connection
+                        jobs.put(job)
+                        print(f"[worker {n}] {e}; stopping.")
+                        return
+                    except Exception as e:
+                        print(f"FAILED to send to {email_addr}: {e}")
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(min(WORKERS, len(worklist)))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    if not jobs.empty():
+        print(f"{jobs.qsize()} messages were not sent because no SMTP connection could be kept open; rerun to resume.")
     print(f"\nCompleted. Sent {count} emails. Skipped {skipped} already sent.")
 
 if __name__ == "__main__":
-    print(f"Found {len(SKIP_EMAILS)} emails already sent.")
-    confirm = input(f"Resume sending to remaining users with {DELAY_SECONDS}s delay? Type 'YES': ")
+    print(f"Found {len(SKIP)} emails already sent.")
+    confirm = input(f"Resume sending to remaining users at {MESSAGES_PER_MINUTE} messages/minute over {WORKERS} connections? Type 'YES': ")
     if confirm == "YES":
         send_announcement()
     else:
@@ -1,13 +1,40 @@
 import os
 import yaml
 import json
+import atexit
 import logging
+import queue
+import mmap
 import re
 import hashlib
-from typing import List, Dict, Pattern
+import hmac
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from datetime import datetime, timezone
+from typing import Iterator, List, Dict, Optional, Pattern, Set, Tuple
 from fastapi import HTTPException
-from starlette.middleware.base import BaseHTTPMiddleware
-from ipaddress import IPv4Address, IPv4Network
+from ipaddress import ip_address, ip_network
+
+try:
+    from yaml import CSafeLoader as SafeLoader  # libyaml-backed; much faster when PyYAML was built with it
+except ImportError:
+    from yaml import SafeLoader
+
+try:
+    import fcntl  # POSIX only; without it registration writes go unlocked
+except ImportError:
+    fcntl = None
+
+try:
+    import pytricia  # Optional; C radix tree for banned IP prefix lookups
+except ImportError:
+    pytricia = None
+
+try:
+    import orjson  # Optional; much faster than the stdlib json for large registration files
+except ImportError:
+    orjson = None
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CONFIG_DIR = os.path.join(BASE_DIR, "config")
@@ -16,115 +43,480 @@ LOGS_DIR = os.path.join(BASE_DIR, "logs")
 
 CONFIG_PATH = os.path.join(CONFIG_DIR, "config.yaml")
 with open(CONFIG_PATH, "r") as f:
-    config = yaml.safe_load(f)
+    config = yaml.load(f, Loader=SafeLoader)
 
-REGISTRATIONS_PATH = os.path.join(DATA_DIR, "registrations.json")
+# One JSON object per line; new registrations are appended rather than rewriting the file
+REGISTRATIONS_PATH = os.path.join(DATA_DIR, "registrations.jsonl")
+# Single JSON array used before registrations.jsonl; migrated once at startup and left as a backup
+LEGACY_REGISTRATIONS_PATH = os.path.join(DATA_DIR, "registrations.json")
+# Held exclusively around appends and rewrites so concurrent writers (other workers,
+# announce/cleanup scripts) never interleave lines or append to a file being replaced
+REGISTRATIONS_LOCK_PATH = REGISTRATIONS_PATH + ".lock"
 
-def load_registrations() -> List[Dict]:
+# Registration files at least this large are read through mmap; below it plain reads are cheaper
+REGISTRATIONS_MMAP_THRESHOLD = 16 * 1024
+
+# (path, parser) -> (stat key, parsed contents)
+_file_cache: Dict[Tuple[str, object], Tuple[object, object]] = {}
+# (path, parser) -> time.monotonic() of the last stat, for callers that pass max_age
+_file_checked: Dict[Tuple[str, object], float] = {}
+
+def _stat_key(path: str) -> Optional[Tuple[int, int]]:
+    """(mtime_ns, size) identifying a version of the file, or None if it does not exist.
+
+    Size catches rewrites that land within the filesystem's mtime granularity.
+    """
     try:
-        with open(REGISTRATIONS_PATH, "r") as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+def _cached_by_stat(path: str, parse, max_age: float = 0):
+    """Return parse(path), re-parsing only when the file's mtime or size changes.
+
+    With max_age, the file is not even stat'ed again until that many seconds have passed.
+    """
+    cached = _file_cache.get((path, parse))
+    if max_age:
+        now = time.monotonic()
+        if cached is not None and now - _file_checked.get((path, parse), 0) < max_age:
+            return cached[1]
+        _file_checked[(path, parse)] = now
+    key = _stat_key(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    value = parse(path)
+    _file_cache[(path, parse)] = (key, value)
+    return value
+
+@contextmanager
+def _registrations_lock():
+    if fcntl is None:
+        yield
+        return
+    with open(REGISTRATIONS_LOCK_PATH, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def _annotate_timestamps(registrations: List[Dict]):
+    """Give entries written before "ts" was stored their registration time in epoch seconds."""
+    for entry in registrations:
+        if "ts" not in entry:
+            # Stored datetimes are naive UTC (get_current_utc().isoformat())
+            entry["ts"] = int(datetime.fromisoformat(entry["datetime"]).replace(tzinfo=timezone.utc).timestamp())
+
+def _loads(raw: bytes):
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+def _dump_line(entry: Dict) -> bytes:
+    if orjson:
+        return orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE)
+    return json.dumps(entry, separators=(",", ":"), ensure_ascii=False).encode("utf-8") + b"\n"
+
+@contextmanager
+def _open_lines(path: str) -> Iterator[Iterator[bytes]]:
+    """Iterate a file's lines, mapping it into memory when it is large enough to benefit.
+
+    The mapping is a fixed view of the file as opened, so concurrent appends and
+    atomic replacements never disturb a read in progress.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < REGISTRATIONS_MMAP_THRESHOLD:
+            yield f
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):  # Linux/macOS: read ahead aggressively
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            yield iter(mm.readline, b"")
+
+def _parse_lines(lines) -> Iterator[Dict]:
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            entry = _loads(line)
+        except json.JSONDecodeError:
+            # Most likely a partial final line from an interrupted append
+            logging.error(f"Skipping malformed line {number} in {REGISTRATIONS_PATH}")
+            continue
+        _annotate_timestamps((entry,))
+        yield entry
+
+def _read_registrations(path: str) -> List[Dict]:
+    try:
+        with _open_lines(path) as lines:
+            return list(_parse_lines(lines))
+    except FileNotFoundError:
         return []
 
+def cached_registrations() -> List[Dict]:
+    """Registrations as parsed once per change to registrations.jsonl.
+
+    The list is shared and must not be modified; it is replaced rather than mutated on save.
+    """
+    return _cached_by_stat(REGISTRATIONS_PATH, _read_registrations)
+
+def load_registrations() -> List[Dict]:
+    # Callers get their own list to modify
+    return list(cached_registrations())
+
+def _replace_registrations(registrations: List[Dict]):
+    # Caller holds _registrations_lock. Write to a sibling temp file and rename over the
+    # original so a crash mid-write never leaves a truncated registrations.jsonl behind;
+    # readers only open the final path.
+    tmp_path = REGISTRATIONS_PATH + ".tmp"
+    _annotate_timestamps(registrations)
+    payload = b"".join(_dump_line(entry) for entry in registrations)
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+        st = os.fstat(f.fileno())
+    os.replace(tmp_path, REGISTRATIONS_PATH)
+    _file_cache[(REGISTRATIONS_PATH, _read_registrations)] = ((st.st_mtime_ns, st.st_size), list(registrations))
+
 def save_registrations(registrations: List[Dict]):
-    with open(REGISTRATIONS_PATH, "w") as f:
-        json.dump(registrations, f, indent=2)
+    with _registrations_lock():
+        _replace_registrations(registrations)
+
+def remove_registrations(removed: List[Dict]) -> List[Dict]:
+    """Drop the given entries from registrations.jsonl and return what remains.
+
+    The file is re-read under the lock, so entries appended since the caller's
+    snapshot are kept.
+    """
+    removed_lines = {_dump_line(entry) for entry in removed}
+    with _registrations_lock():
+        remaining = [entry for entry in cached_registrations() if _dump_line(entry) not in removed_lines]
+        _replace_registrations(remaining)
+    return remaining
+
+def index_registrations(registrations: List[Dict]) -> Tuple[Dict[str, List[Dict]], Dict[str, Dict]]:
+    """Index registrations by normalized email (all entries) and lowercased username (latest entry)."""
+    by_email: Dict[str, List[Dict]] = {}
+    by_name: Dict[str, Dict] = {}
+    for entry in registrations:
+        email = entry.get("email")
+        if email:
+            by_email.setdefault(email.strip().lower(), []).append(entry)
+        name = entry.get("requested_name")
+        if name:
+            by_name[name.lower()] = entry
+    return by_email, by_name
+
+def _add_to_lookups(entry: Dict, latest_by_email: Dict[str, int], used_usernames: Set[str]):
+    email = entry.get("email")
+    if email:
+        key = email.strip().lower()
+        latest_by_email[key] = max(latest_by_email.get(key, 0), entry["ts"])
+    used_usernames.add(entry["requested_name"].lower())
+
+def _build_registration_lookups(path: str) -> Tuple[Dict[str, int], Set[str]]:
+    latest_by_email: Dict[str, int] = {}
+    used_usernames: Set[str] = set()
+    for entry in cached_registrations():
+        _add_to_lookups(entry, latest_by_email, used_usernames)
+    return latest_by_email, used_usernames
+
+def _registration_lookups() -> Tuple[Dict[str, int], Set[str]]:
+    """Normalized email -> newest registration (epoch seconds), and the set of requested usernames."""
+    return _cached_by_stat(REGISTRATIONS_PATH, _build_registration_lookups)
+
+def latest_registration_ts(email: str) -> Optional[int]:
+    """Epoch seconds of the newest registration made with this address, or None (case-insensitive)."""
+    return _registration_lookups()[0].get(email.strip().lower())
+
+def requested_usernames() -> Set[str]:
+    """Lowercased usernames with a registration on file; shared, do not modify."""
+    return _registration_lookups()[1]
+
+def is_username_requested(username: str) -> bool:
+    return username.lower() in _registration_lookups()[1]
 
 def save_registration(data: Dict):
     registrations = load_registrations()
+    lookups = _registration_lookups()
+    cached_keys = {_file_cache[(REGISTRATIONS_PATH, parse)][0] for parse in (_read_registrations, _build_registration_lookups)}
+    line = _dump_line(data)
+    with _registrations_lock(), open(REGISTRATIONS_PATH, "a+b") as f:
+        st = os.fstat(f.fileno())
+        # The caches only describe this file if no other writer got in since they were filled
+        up_to_date = cached_keys == {(st.st_mtime_ns, st.st_size)}
+        # Start on a fresh line if a previous append was cut short
+        if f.seek(0, os.SEEK_END) and (f.seek(-1, os.SEEK_END), f.read(1))[1] != b"\n":
+            line = b"\n" + line
+        f.write(line)
+        f.flush()
+        st = os.fstat(f.fileno())
+    if not up_to_date:
+        _file_cache.pop((REGISTRATIONS_PATH, _read_registrations), None)
+        _file_cache.pop((REGISTRATIONS_PATH, _build_registration_lookups), None)
+        return
+    # Fold the new entry into the cached list and lookups rather than re-reading the file
+    _annotate_timestamps((data,))
     registrations.append(data)
+    _add_to_lookups(data, *lookups)
+    key = (st.st_mtime_ns, st.st_size)
+    _file_cache[(REGISTRATIONS_PATH, _read_registrations)] = (key, registrations)
+    _file_cache[(REGISTRATIONS_PATH, _build_registration_lookups)] = (key, lookups)
+
+def _migrate_legacy_registrations():
+    if os.path.exists(REGISTRATIONS_PATH) or not os.path.exists(LEGACY_REGISTRATIONS_PATH):
+        return
+    try:
+        with open(LEGACY_REGISTRATIONS_PATH, "rb") as f:
+            registrations = _loads(f.read())
+    except json.JSONDecodeError as e:
+        logging.error(f"Could not migrate {LEGACY_REGISTRATIONS_PATH}: {e}")
+        return
     save_registrations(registrations)
+    logging.info(f"Migrated {len(registrations)} registrations from {LEGACY_REGISTRATIONS_PATH} to {REGISTRATIONS_PATH}")
+
+BANNED_USERNAMES_PATH = os.path.join(CONFIG_DIR, "banned_usernames.txt")
+BANNED_EMAILS_PATH = os.path.join(CONFIG_DIR, "banned_emails.txt")
+BANNED_IPS_PATH = os.path.join(CONFIG_DIR, "banned_ips.txt")
+# Ban lists are re-stat'ed at most this often, so edits apply within this many seconds
+BAN_LIST_RECHECK_SECONDS = 30
+
+def _union_patterns(patterns: List[Pattern]) -> List[Pattern]:
+    """Fold case-insensitive patterns into one alternation so a check is a single regex scan.
+
+    Only patterns without groups are folded: joining renumbers groups, which would point
+    backreferences like (\\d)\\1 at the wrong group. The rest stay compiled on their own, as do
+    all of them if they cannot be combined (e.g. inline global flags).
+    """
+    fusable = [p for p in patterns if not p.groups]
+    if len(fusable) < 2:
+        return patterns
+    try:
+        combined = re.compile("|".join(f"(?:{p.pattern})" for p in fusable), re.IGNORECASE)
+    except re.error:
+        return patterns
+    return [combined] + [p for p in patterns if p.groups]
+
+def _parse_banned_usernames(path: str) -> Dict[str, object]:
+    """Split banned-username regexes into literal fast paths and real patterns.
 
-def load_banned_usernames() -> List[Pattern]:
-    patterns = []
+    Lines are searched anywhere in the name, so "word" and ".*word.*" are plain substring
+    checks and "^word$" is an exact match; only the rest need the regex engine.
+    exact: lowercased names; substrings: lowercased fragments; patterns: one combined regex.
+    """
+    exact, substrings, patterns = set(), [], []
     try:
-        with open(os.path.join(CONFIG_DIR, "banned_usernames.txt"), "r") as f:
+        with open(path, "r") as f:
             for line in f:
                 line = line.strip()
-                if line:
-                    try:
-                        patterns.append(re.compile(line, re.IGNORECASE))
-                    except re.error:
-                        logging.error(f"Invalid regex pattern in banned_usernames.txt: {line}")
+                if not line:
+                    continue
+                if line.startswith("^") and line.endswith("$") and re.escape(line[1:-1]) == line[1:-1]:
+                    exact.add(line[1:-1].lower())
+                    continue
+                core = line.removeprefix(".*").removesuffix(".*")
+                if core and re.escape(core) == core:
+                    substrings.append(core.lower())
+                    continue
+                try:
+                    patterns.append(re.compile(line, re.IGNORECASE))
+                except re.error:
+                    logging.error(f"Invalid regex pattern in banned_usernames.txt: {line}")
     except FileNotFoundError:
         pass
-    return patterns
+    return {"exact": exact, "substrings": tuple(substrings), "patterns": _union_patterns(patterns)}
 
-def is_ip_banned(ip: str) -> bool:
-    try:
-        check_ip = IPv4Address(ip)
-        try:
-            with open(os.path.join(CONFIG_DIR, "banned_ips.txt"), "r") as f:
-                for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    try:
-                        if '/' in line:
-                            if check_ip in IPv4Network(line):
-                                return True
-                        else:
-                            if check_ip == IPv4Address(line):
-                                return True
-                    except ValueError:
-                        logging.error(f"Invalid IP/CIDR in banned_ips.txt: {line}")
-        except FileNotFoundError:
-            return False
-    except ValueError:
-        logging.error(f"Invalid IP address to check: {ip}")
-    return False
+def _parse_banned_emails(path: str) -> Dict[str, object]:
+    """Sort banned-email globs into O(1)-checkable buckets, with regex only as a fallback.
 
-def is_email_banned(email: str) -> bool:
+    exact: full addresses; domains: "*@domain"; suffixes: "*tail"; prefixes: "head*";
+    patterns: anything else, as one combined regex.
+    """
+    exact, domains, suffixes, prefixes, patterns = set(), set(), [], [], []
     try:
-        with open(os.path.join(CONFIG_DIR, "banned_emails.txt"), "r") as f:
+        with open(path, "r") as f:
             for line in f:
                 pattern = line.strip()
                 if not pattern:
                     continue
-                regex_pattern = pattern.replace(".", "\\.").replace("*", ".*")
+                literal = pattern.lower()
+                stars = literal.count("*")
+                if stars == 0:
+                    exact.add(literal)
+                elif stars == 1 and literal.startswith("*@"):
+                    domains.add(literal[2:])
+                elif stars == 1 and literal.startswith("*"):
+                    suffixes.append(literal[1:])
+                elif stars == 1 and literal.endswith("*"):
+                    prefixes.append(literal[:-1])
+                else:
+                    # Only "*" is special; everything else (".", "+", ...) matches literally
+                    patterns.append(re.compile(re.escape(pattern).replace(r"\*", ".*"), re.IGNORECASE))
+    except FileNotFoundError:
+        pass
+    return {
+        "exact": exact,
+        "domains": domains,
+        "suffixes": tuple(suffixes),
+        "prefixes": tuple(prefixes),
+        "patterns": _union_patterns(patterns)
+    }
+
+def load_banned_usernames() -> Dict[str, object]:
+    return _cached_by_stat(BANNED_USERNAMES_PATH, _parse_banned_usernames, BAN_LIST_RECHECK_SECONDS)
+
+def load_banned_emails() -> Dict[str, object]:
+    return _cached_by_stat(BANNED_EMAILS_PATH, _parse_banned_emails, BAN_LIST_RECHECK_SECONDS)
+
+def _parse_banned_ips(path: str) -> Dict[int, object]:
+    """Build a longest-prefix-match structure per IP version.
+
+    With pytricia each version gets a radix tree. Otherwise each version maps to
+    (netmask as int, network addresses as ints) pairs, longest prefix first, so a
+    lookup is one integer mask-and-set-probe per distinct prefix length.
+    """
+    by_prefix: Dict[int, Dict[int, Set[int]]] = {4: {}, 6: {}}
+    parsed: Dict[int, list] = {4: [], 6: []}
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
                 try:
-                    if re.match(regex_pattern, email, re.IGNORECASE):
-                        return True
-                except re.error:
-                    logging.error(f"Invalid email pattern in banned_emails.txt: {pattern}")
+                    network = ip_network(line, strict=False)
+                except ValueError:
+                    logging.error(f"Invalid IP/CIDR in banned_ips.txt: {line}")
+                    continue
+                if pytricia:
+                    parsed[network.version].append(network)
+                else:
+                    by_prefix[network.version].setdefault(network.prefixlen, set()).add(int(network.network_address))
     except FileNotFoundError:
         pass
-    return False
+    banned = {}
+    if pytricia:
+        for version, networks in parsed.items():
+            tree = pytricia.PyTricia(32 if version == 4 else 128)
+            # Insert the parsed networks as-is: rebuilding one from an int would turn
+            # an IPv6 network whose value fits in 32 bits (e.g. ::/8) into IPv4
+            for network in networks:
+                tree.insert(str(network), True)
+            banned[version] = tree
+        return banned
+    for version, prefixes in by_prefix.items():
+        bits = 32 if version == 4 else 128
+        full = (1 << bits) - 1
+        banned[version] = [
+            (full ^ (full >> prefixlen), networks)
+            for prefixlen, networks in sorted(prefixes.items(), reverse=True)
+        ]
+    return banned
+
+def load_banned_ips() -> Dict[int, object]:
+    return _cached_by_stat(BANNED_IPS_PATH, _parse_banned_ips, BAN_LIST_RECHECK_SECONDS)
+
+def is_ip_banned(ip: str) -> bool:
+    banned = load_banned_ips()
+    if not (banned[4] or banned[6]):
+        return False  # Empty ban list (the default): skip parsing the address at all
+    try:
+        check_ip = ip_address(ip)
+    except ValueError:
+        logging.error(f"Invalid IP address to check: {ip}")
+        return False
+    if check_ip.version == 6 and check_ip.ipv4_mapped is not None:
+        check_ip = check_ip.ipv4_mapped
+    if pytricia:
+        return check_ip in banned[check_ip.version]
+    value = int(check_ip)
+    return any(value & mask in networks for mask, networks in banned[check_ip.version])
+
+def is_email_banned(email: str) -> bool:
+    # Globs describe the whole address, so "*@example.com" must not match "x@example.com.evil"
+    banned = load_banned_emails()
+    address = email.lower()
+    _, at, domain = address.rpartition("@")
+    return (
+        address in banned["exact"]
+        or (at and domain in banned["domains"])
+        or address.endswith(banned["suffixes"])
+        or address.startswith(banned["prefixes"])
+        or any(pattern.fullmatch(email) for pattern in banned["patterns"])
+    )
 
 def is_username_banned(username: str) -> bool:
-    patterns = load_banned_usernames()
-    return any(pattern.search(username) for pattern in patterns)
+    banned = load_banned_usernames()
+    name = username.lower()
+    return (
+        name in banned["exact"]
+        or any(fragment in name for fragment in banned["substrings"])
+        or any(pattern.search(username) for pattern in banned["patterns"])
+    )
 
-def read_registration_token():
-    token_path = os.path.join(DATA_DIR, ".registration_token")
+REGISTRATION_TOKEN_PATH = os.path.join(DATA_DIR, ".registration_token")
+
+def _read_token_file(path: str) -> Optional[str]:
     try:
-        with open(token_path, "r") as f:
+        with open(path, "r") as f:
             return f.read().strip()
     except FileNotFoundError:
         return None
 
-# Logging setup
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    filename=os.path.join(LOGS_DIR, "registration.log"),
-    filemode='a'
-)
+def read_registration_token() -> Optional[str]:
+    # Rotated by launch.sh at each reset; re-read only when the file changes
+    return _cached_by_stat(REGISTRATION_TOKEN_PATH, _read_token_file)
+
+# Logging setup: handlers only enqueue records; a listener thread does the file writes,
+# so request handling never waits on disk
+_log_file_handler = logging.FileHandler(os.path.join(LOGS_DIR, "registration.log"), mode='a')
+_log_file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+_log_queue = queue.SimpleQueue()
+_log_listener = QueueListener(_log_queue, _log_file_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)  # Drains anything still queued before exit
+_log_queue_handler = QueueHandler(_log_queue)
+_log_queue_handler.setFormatter(logging.Formatter())  # Message only; the file handler adds time and level
+logging.basicConfig(level=logging.INFO, handlers=[_log_queue_handler])
 logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
 logging.getLogger("uvicorn.error").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
-class CustomLoggingMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
-        if request.url.path == "/api/time" or request.url.path.endswith('favicon.ico'):
-            return await call_next(request)
-        response = await call_next(request)
-        logger.info(f"Request: {request.method} {request.url.path} - Status: {response.status_code}")
-        return response
+_migrate_legacy_registrations()
+
+# Polled or fetched by browsers on every page; not worth a log line
+UNLOGGED_PATHS = frozenset({"/api/time", "/favicon.ico", "/static/favicon.ico"})
+
+class CustomLoggingMiddleware:
+    """Plain ASGI middleware: reads method, path and status straight off the scope and messages."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (path := scope["path"]) in UNLOGGED_PATHS:
+            await self.app(scope, receive, send)
+            return
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Arguments rather than an f-string: the message is only formatted if the record is emitted
+            logger.info("Request: %s %s - Status: %s", scope["method"], path, status_code)
+
+# The admin token is the SHA-256 of the configured password, fixed for the life of the process
+ADMIN_TOKEN = hashlib.sha256(config["matrix_admin"].get("password", "").encode()).hexdigest()
+_ADMIN_TOKEN_BYTES = ADMIN_TOKEN.encode()
 
 def verify_admin_auth(auth_token: str) -> None:
-    expected_password = config["matrix_admin"].get("password", "")
-    expected_hash = hashlib.sha256(expected_password.encode()).hexdigest()
-    if auth_token != expected_hash:
+    # Compared as bytes: compare_digest rejects str arguments containing non-ASCII characters
+    if not hmac.compare_digest(auth_token.encode(), _ADMIN_TOKEN_BYTES):
         raise HTTPException(status_code=403, detail="Invalid authentication token")
@@ -1,10 +1,17 @@
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from sw1tch import BASE_DIR, CustomLoggingMiddleware
 from sw1tch.routes import admin, canary, public
+from sw1tch.utilities.registration import close_http_client
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await close_http_client()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(CustomLoggingMiddleware)
 app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "static")), name="static")
 
@@ -19,5 +26,7 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=config["port"],
 #        reload=True,
+        loop="auto",  # uvloop and httptools when installed, else asyncio and h11
+        http="auto",
         access_log=False
     )
@@ -12,11 +12,25 @@ import ntplib
 import calendar
 import time
 import email.utils
+import xml.etree.ElementTree as ElementTree
+import json
+import atexit
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from datetime import timezone # For timezone-aware datetime objects
 
+try:
+    from yaml import CSafeLoader as SafeLoader  # libyaml-backed; much faster when PyYAML was built with it
+except ImportError:
+    from yaml import SafeLoader
+
+try:
+    import gnupg  # Optional: python-gnupg, used for signing when installed
+except ImportError:
+    gnupg = None
+
 # --- Configuration ---
 # File paths relative to the script's parent directory (sw1tch/)
 TOP_DIR = Path(__file__).parent.parent
@@ -25,7 +39,86 @@ CONFIG_FILE = BASE_DIR / "config" / "config.yaml"
 ATTESTATIONS_FILE = BASE_DIR / "config" / "attestations.txt"
 OUTPUT_FILE = TOP_DIR / "canary.txt"
 # OUTPUT_FILE = BASE_DIR / "data" / "canary.txt"
-TEMP_MESSAGE_FILE = BASE_DIR / "data" / "temp_canary_message.txt" # For GPG signing
+
+# Per-endpoint health for the NTP servers and Monero nodes, kept across runs so a dead
+# endpoint is tried last instead of costing a full timeout every time
+ENDPOINT_HEALTH_FILE = BASE_DIR / "data" / "endpoint_health.json"
+ENDPOINT_TIMEOUT = 4  # Seconds; short because there is always another endpoint to fail over to
+ENDPOINT_MAX_COOLDOWN = 3600
+
+# Validators and result of the last RSS fetch per feed URL, for conditional GETs
+RSS_CACHE_FILE = BASE_DIR / "data" / "rss_cache.json"
+
+def load_json_state(path):
+    """Loads a small JSON state dict kept between runs, or starts fresh."""
+    try:
+        with open(path, 'r') as f:
+            state = json.load(f)
+        return state if isinstance(state, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def save_json_state(path, state):
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = path.with_name(path.name + ".tmp")
+        with open(temp_file, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(temp_file, path)
+    except OSError as e:
+        print(f"Warning: Could not save {path}: {e}")
+
+# {url: {latency, failures, cooldown_until}}
+ENDPOINT_HEALTH = load_json_state(ENDPOINT_HEALTH_FILE)
+atexit.register(lambda: save_json_state(ENDPOINT_HEALTH_FILE, ENDPOINT_HEALTH))
+
+def order_endpoints(endpoints):
+    """Healthy endpoints first, fastest first; endpoints cooling down after failures go last."""
+    now = time.time()
+    def sort_key(url):
+        health = ENDPOINT_HEALTH.get(url, {})
+        return (health.get('cooldown_until', 0) > now, health.get('latency', float('inf')))
+    return sorted(endpoints, key=sort_key)
+
+def record_endpoint_success(url, elapsed):
+    health = ENDPOINT_HEALTH.setdefault(url, {})
+    previous = health.get('latency')
+    health['latency'] = elapsed if previous is None else 0.7 * previous + 0.3 * elapsed
+    health['failures'] = 0
+    health['cooldown_until'] = 0
+
+def record_endpoint_failure(url):
+    health = ENDPOINT_HEALTH.setdefault(url, {})
+    health['failures'] = health.get('failures', 0) + 1
+    cooldown = min(30 * 2 ** health['failures'], ENDPOINT_MAX_COOLDOWN)
+    health['cooldown_until'] = time.time() + cooldown
+
+# One pooled session for all HTTP lookups, so retries and repeat calls reuse connections
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount("http://", HTTPAdapter(max_retries=Retry(
+    total=2,
+    connect=0,  # Unreachable nodes fall through to the next one in the list instead
+    read=0,
+    backoff_factor=0.5,
+    status_forcelist=(502, 503, 504),
+    allowed_methods=frozenset({"GET", "POST"})  # get_last_block_header is read-only
+)))
+HTTP_SESSION.mount("https://", HTTP_SESSION.get_adapter("http://"))
+
+# Created on first signature and reused, so repeated signing (e.g. main() run from a
+# scheduler) sets up the keyring once; importing this module never starts gpg
+_GPG = None
+
+def get_gpg():
+    """Returns the shared python-gnupg handle, or None to sign with the gpg command instead."""
+    global _GPG, gnupg
+    if _GPG is None and gnupg is not None:
+        try:
+            _GPG = gnupg.GPG()
+        except (OSError, ValueError) as e:
+            print(f"Warning: python-gnupg unavailable, falling back to the gpg command: {e}")
+            gnupg = None
+    return _GPG
 
 # --- Core Functions ---
 
@@ -36,7 +129,7 @@ def load_config():
             print(f"Error: Configuration file '{CONFIG_FILE}' not found.")
             sys.exit(1)
         with open(CONFIG_FILE, 'r') as file:
-            config = yaml.safe_load(file)
+            config = yaml.load(file, Loader=SafeLoader)
 
         # Validate essential non-Matrix config fields
         required = [
@@ -103,11 +196,13 @@ def get_nist_time():
         '1.pool.ntp.org'
     ]
     
-    for server in ntp_servers:
+    for server in order_endpoints(ntp_servers):
         try:
             print(f"Fetching time from NTP server {server}...")
+            started = time.monotonic()
             ntp_client = ntplib.NTPClient()
-            response = ntp_client.request(server, version=3, timeout=10)
+            response = ntp_client.request(server, version=3, timeout=ENDPOINT_TIMEOUT)
+            record_endpoint_success(server, time.monotonic() - started)
             
             # Convert NTP timestamp to UTC datetime
             # NTP epoch is 1900-01-01, Unix epoch is 1970-01-01
@@ -120,8 +215,10 @@ def get_nist_time():
             
         except ntplib.NTPException as e:
             print(f"NTP error from {server}: {e}")
+            record_endpoint_failure(server)
         except Exception as e:
             print(f"Error fetching time from NTP server {server}: {e}")
+            record_endpoint_failure(server)
     
     print("Error: Could not fetch time from any NTP source. Falling back to system time.")
     return datetime.datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
@@ -163,6 +260,83 @@ def get_entry_date(entry):
     
     return None
 
+# RSS/Atom child elements (namespace stripped) -> keys understood by get_entry_date
+FEED_DATE_FIELDS = {
+    'pubDate': 'pubDate',
+    'published': 'published',
+    'updated': 'updated',
+    'issued': 'issued',
+    'created': 'created',
+    'date': 'dc_date',
+}
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def stream_latest_feed_entry(rss_url):
+    """Streams the feed through iterparse and returns the newest <item>/<entry> as a dict.
+
+    Each entry is reduced to title, link and date strings and then cleared, so only one
+    entry is ever held in memory. Falls back to feed order when no entry has a usable date.
+    """
+    # Ask the server to skip the body if the feed has not changed since the last fetch
+    rss_cache = load_json_state(RSS_CACHE_FILE)
+    cached = rss_cache.get(rss_url)
+    headers = {}
+    if cached and cached.get('etag'):
+        headers['If-None-Match'] = cached['etag']
+    if cached and cached.get('last_modified'):
+        headers['If-Modified-Since'] = cached['last_modified']
+
+    best, best_date, first = None, None, None
+    with HTTP_SESSION.get(rss_url, stream=True, timeout=10, headers=headers) as response:
+        if response.status_code == 304 and cached:
+            print("Feed unchanged since last fetch (304); reusing cached headline")
+            return {"title": cached['title'], "link": cached['link']}
+        response.raise_for_status()
+        validators = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified')
+        }
+        response.raw.decode_content = True  # Let urllib3 undo gzip/deflate
+        for _, elem in ElementTree.iterparse(response.raw, events=('end',)):
+            if local_name(elem.tag) not in ('item', 'entry'):
+                continue
+            entry = {}
+            for child in elem:
+                name = local_name(child.tag)
+                if name == 'title':
+                    entry['title'] = (child.text or '').strip()
+                elif name == 'link' and 'link' not in entry:
+                    # RSS puts the URL in the text, Atom in href (prefer the alternate link)
+                    if child.get('rel', 'alternate') == 'alternate':
+                        entry['link'] = (child.get('href') or child.text or '').strip()
+                elif name in FEED_DATE_FIELDS and child.text:
+                    entry[FEED_DATE_FIELDS[name]] = child.text.strip()
+            elem.clear()
+            if first is None:
+                first = entry
+            entry_date = get_entry_date(entry)
+            if entry_date is not None and (best_date is None or entry_date > best_date):
+                best, best_date = entry, entry_date
+    if best is not None:
+        selected_date = datetime.datetime.fromtimestamp(best_date, timezone.utc)
+        print(f"Selected most recent entry from {selected_date.strftime('%Y-%m-%d %H:%M:%S UTC')}")
+        selected = best
+    else:
+        if first is not None:
+            print("No parseable dates found, using first entry in feed order")
+        selected = first
+    if selected is not None and (validators['etag'] or validators['last_modified']):
+        rss_cache[rss_url] = {
+            **validators,
+            'title': selected.get('title', 'Untitled'),
+            'link': selected.get('link', ''),
+            'fetched_at': int(time.time())
+        }
+        save_json_state(RSS_CACHE_FILE, rss_cache)
+    return selected
+
 def get_rss_headline(config):
     """Fetches the most recent headline and link from the configured RSS feed."""
     try:
@@ -171,7 +345,18 @@ def get_rss_headline(config):
         rss_url = rss_config.get('url', 'https://www.theguardian.com/world/rss')
         rss_name = rss_config.get('name', 'The Guardian')
         print(f"Fetching {rss_name} headline from {rss_url}...")
-        
+
+        try:
+            entry = stream_latest_feed_entry(rss_url)
+            if entry:
+                return {
+                    "title": entry.get("title", "Untitled"),
+                    "link": entry.get("link", "")
+                }
+        except (requests.exceptions.RequestException, ElementTree.ParseError) as e:
+            print(f"Streaming parse of {rss_url} failed ({e}); retrying with feedparser")
+
+        # feedparser copes with malformed feeds the strict XML parser rejects
         feed = feedparser.parse(rss_url)
         if not feed.entries:
             print(f"No entries found in RSS feed: {rss_url}")
@@ -225,14 +410,15 @@ def get_monero_latest_block():
         "method": "get_last_block_header"
     }
     
-    for node_url in rpc_nodes:
+    for node_url in order_endpoints(rpc_nodes):
         try:
             print(f"Fetching Monero block from {node_url}...")
-            response = requests.post(
+            started = time.monotonic()
+            response = HTTP_SESSION.post(
                 node_url, 
                 json=rpc_payload,
                 headers={'Content-Type': 'application/json'},
-                timeout=15
+                timeout=ENDPOINT_TIMEOUT
             )
             response.raise_for_status()
             data = response.json()
@@ -240,6 +426,7 @@ def get_monero_latest_block():
             # Validate response structure
             if 'result' not in data or 'block_header' not in data['result']:
                 print(f"Warning: Unexpected response format from {node_url}")
+                record_endpoint_failure(node_url)
                 continue
             
             block_header = data['result']['block_header']
@@ -247,6 +434,7 @@ def get_monero_latest_block():
             # Validate required fields
             if not all(k in block_header for k in ['height', 'hash', 'timestamp']):
                 print(f"Warning: Missing required fields in block header from {node_url}")
+                record_endpoint_failure(node_url)
                 continue
             
             height = block_header['height']
@@ -260,6 +448,7 @@ def get_monero_latest_block():
             ).strftime("%Y-%m-%d %H:%M:%S UTC")
             
             print(f"Successfully fetched Monero block: Height={height}, Hash={block_hash[:10]}...")
+            record_endpoint_success(node_url, time.monotonic() - started)
             
             return {
                 "height": height,
@@ -269,9 +458,11 @@ def get_monero_latest_block():
             
         except requests.exceptions.RequestException as e:
             print(f"Error fetching from {node_url}: {e}")
+            record_endpoint_failure(node_url)
             continue
         except (KeyError, ValueError) as e:
             print(f"Error parsing response from {node_url}: {e}")
+            record_endpoint_failure(node_url)
             continue
     
     # If all nodes fail
@@ -318,9 +509,14 @@ def get_optional_note():
 
 def create_warrant_canary_message(config, is_interactive):
     """Constructs the main body of the warrant canary message."""
-    nist_time = get_nist_time()
-    rss_data = get_rss_headline(config)
-    monero_block = get_monero_latest_block()
+    # The three sources are independent network lookups; fetch them concurrently
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        nist_future = executor.submit(get_nist_time)
+        rss_future = executor.submit(get_rss_headline, config)
+        monero_future = executor.submit(get_monero_latest_block)
+    nist_time = nist_future.result()
+    rss_data = rss_future.result()
+    monero_block = monero_future.result()
 
     # Ensure all required data points were fetched
     if not all([nist_time, rss_data, monero_block]):
@@ -349,22 +545,28 @@ def create_warrant_canary_message(config, is_interactive):
     else: suffixes = {1: 'st', 2: 'nd', 3: 'rd'}; suffix = suffixes.get(day % 10, 'th')
     current_date_str = datetime.datetime.now().strftime(f'%d{suffix} day of %B, %Y')
 
-    # Build the message string
-    message = f"{org} Warrant Canary · {nist_time}\n\n"
-    message += f"I, {admin_name}, the {admin_title} of {org}, state this {current_date_str}:\n"
-    for i, attestation in enumerate(selected_attestations, 1):
-        message += f"  {i}. {org} {attestation}\n"
+    # Build the message as a list of lines, joined once at the end
+    lines = [
+        f"{org} Warrant Canary · {nist_time}",
+        "",
+        f"I, {admin_name}, the {admin_title} of {org}, state this {current_date_str}:",
+    ]
+    lines.extend(f"  {i}. {org} {attestation}" for i, attestation in enumerate(selected_attestations, 1))
 
     if note:
-        message += f"\nNOTE: {note}\n"
-
-    message += "\nDatestamp Proof:\n"
-    message += f"  News headline: {rss_data['title']}\n"
-    message += f"  News URL:      {rss_data['link']}\n"
-    message += f"  XMR block:     #{monero_block['height']}, {monero_block['time']}\n"
-    message += f"  Block hash:    {monero_block['hash']}\n\n"
+        lines += ["", f"NOTE: {note}"]
+
+    lines += [
+        "",
+        "Datestamp Proof:",
+        f"  News headline: {rss_data['title']}",
+        f"  News URL:      {rss_data['link']}",
+        f"  XMR block:     #{monero_block['height']}, {monero_block['time']}",
+        f"  Block hash:    {monero_block['hash']}",
+        "",
+    ]
 
-    return message
+    return "\n".join(lines) + "\n"
 
 def sign_with_gpg(message, gpg_key_id):
     """Signs the message using GPG clearsign with the specified key ID."""
@@ -372,61 +574,48 @@ def sign_with_gpg(message, gpg_key_id):
          print("Error: GPG Key ID is missing in config.")
          return None
     try:
-        TEMP_MESSAGE_FILE.parent.mkdir(parents=True, exist_ok=True)
-
         print(f"Signing message with GPG key ID: {gpg_key_id}...")
-        # Ensure input message ends with exactly one newline for GPG
-        with open(TEMP_MESSAGE_FILE, "w", newline='\n', encoding='utf-8') as f:
-            f.write(message.rstrip() + '\n')
-
-        # Use --batch and --yes for non-interactive signing
-        cmd = ["gpg", "--batch", "--yes", "--clearsign", "--default-key", gpg_key_id, str(TEMP_MESSAGE_FILE)]
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True, encoding='utf-8')
-
-        # GPG might write to stdout or file depending on version/environment
-        signed_message_path = Path(f"{TEMP_MESSAGE_FILE}.asc")
-        if signed_message_path.exists():
-            with open(signed_message_path, "r", encoding='utf-8') as f:
-                signed_message = f.read()
-            print(f"GPG signing successful (read from {signed_message_path}).")
-        elif result.stdout:
-             signed_message = result.stdout
-             print("GPG signing successful (read from stdout).")
-        else:
-             print("Error: GPG signed message file not found and no stdout output.")
-             if TEMP_MESSAGE_FILE.exists(): os.remove(TEMP_MESSAGE_FILE)
+        gpg = get_gpg()
+        if gpg is not None:
+            signed = gpg.sign(message.rstrip() + '\n', keyid=gpg_key_id, clearsign=True, detach=False)
+            if not signed:
+                print(f"GPG signing error: {signed.status or 'No output'}\n{signed.stderr}")
+                return None
+            print("GPG signing successful.")
+            return str(signed)
+
+        # Message goes in on stdin and the clearsigned text comes back on stdout, so
+        # nothing is written to (or left behind in) the data directory.
+        # Ensure input message ends with exactly one newline for GPG.
+        # Use --batch and --yes for non-interactive signing.
+        cmd = ["gpg", "--batch", "--yes", "--clearsign", "--default-key", gpg_key_id]
+        result = subprocess.run(cmd, input=message.rstrip() + '\n', check=True, capture_output=True, text=True, encoding='utf-8')
+        if not result.stdout:
+             print("Error: GPG produced no signed output.")
              return None
-
-        # Clean up temporary files
-        if TEMP_MESSAGE_FILE.exists(): os.remove(TEMP_MESSAGE_FILE)
-        if signed_message_path.exists(): os.remove(signed_message_path)
-
-        # Return the raw signed message
-        return signed_message
+        print("GPG signing successful.")
+        return result.stdout
 
     except subprocess.CalledProcessError as e:
         print(f"GPG signing error (Exit code: {e.returncode}): {e.stderr or e.stdout or 'No output'}")
-        if TEMP_MESSAGE_FILE.exists(): os.remove(TEMP_MESSAGE_FILE)
-        signed_message_path = Path(f"{TEMP_MESSAGE_FILE}.asc")
-        if signed_message_path.exists(): os.remove(signed_message_path)
         return None
     except FileNotFoundError:
         print("Error: 'gpg' command not found. Is GnuPG installed and in your PATH?")
         return None
     except Exception as e:
         print(f"Error during GPG signing: {e}")
-        if TEMP_MESSAGE_FILE.exists(): os.remove(TEMP_MESSAGE_FILE)
-        signed_message_path = Path(f"{TEMP_MESSAGE_FILE}.asc")
-        if signed_message_path.exists(): os.remove(signed_message_path)
         return None
 
 def save_warrant_canary(signed_message):
     """Saves the signed warrant canary message to the output file."""
     try:
         OUTPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
-        # Write exactly what GPG (or our adjusted version) gave us
-        with open(OUTPUT_FILE, "w", newline='\n', encoding='utf-8') as f:
+        # Write exactly what GPG (or our adjusted version) gave us, via a temp
+        # file so canary.sh never sees (and commits) a half-written canary
+        temp_output = OUTPUT_FILE.with_name(OUTPUT_FILE.name + ".tmp")
+        with open(temp_output, "w", newline='\n', encoding='utf-8') as f:
             f.write(signed_message)
+        os.replace(temp_output, OUTPUT_FILE)
         print(f"Warrant canary saved to {OUTPUT_FILE}")
         return True
     except Exception as e:
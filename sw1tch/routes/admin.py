@@ -1,23 +1,28 @@
 from fastapi import APIRouter, Form, Depends, Request, HTTPException
 from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from datetime import datetime, timedelta
 import httpx
-import re
 import os
 import hashlib
+import hmac
 import json
 import asyncio
+import time
+from typing import Dict, Iterator, Optional, Tuple
 
-from sw1tch import BASE_DIR, config, logger, load_registrations, save_registrations, verify_admin_auth
+from sw1tch import BASE_DIR, config, logger, cached_registrations, load_registrations, save_registrations, remove_registrations, requested_usernames, verify_admin_auth, ADMIN_TOKEN
+from sw1tch.utilities.time import get_current_utc
+from sw1tch.utilities.registration import get_http_client, HTTP_MAX_CONNECTIONS
 from sw1tch.utilities.matrix import (
     get_matrix_users, 
-    deactivate_user, 
+    deactivate_users, 
     get_matrix_rooms, 
     get_room_members, 
     check_banned_room_name,
     get_matched_pattern,
-    matrix_bot
+    matrix_bot,
+    ROOM_LINE_PATTERN,
+    MEMBER_LINE_PATTERN
 )
 
 router = APIRouter(prefix="/_admin")
@@ -33,9 +38,8 @@ async def admin_login_page(request: Request):
 
 @router.post("/login", response_class=HTMLResponse)
 async def admin_login(request: Request, password: str = Form(...)):
-    expected_password = config["matrix_admin"].get("password", "")
     hashed_password = hashlib.sha256(password.encode()).hexdigest()
-    if hashed_password == hashlib.sha256(expected_password.encode()).hexdigest():
+    if hmac.compare_digest(hashed_password, ADMIN_TOKEN):
         return HTMLResponse(
             content=f"""
             <html>
@@ -51,119 +55,123 @@ async def admin_login(request: Request, password: str = Form(...)):
     else:
         return templates.TemplateResponse("admin.html", {"request": request, "authenticated": False, "error": "Invalid password"})
 
+CHECK_CONCURRENCY = HTTP_MAX_CONNECTIONS  # Parallel availability lookups against the homeserver
+
+async def check_username_exists(username: str, client: httpx.AsyncClient) -> Optional[bool]:
+    """True if the account exists, False if the name is still available, None if unknown."""
+    try:
+        response = await client.get("/_matrix/client/v3/register/available", params={"username": username})
+        if response.status_code == 200:
+            return not response.json().get("available", False)
+        elif response.status_code == 400:
+            return True
+        logger.warning(f"Unexpected response for {username}: {response.status_code}")
+    except httpx.RequestError as ex:
+        logger.error(f"Error checking username {username}: {ex}")
+    return None
+
+async def check_usernames_exist(usernames, client: httpx.AsyncClient, concurrency: int = CHECK_CONCURRENCY) -> Dict[str, Optional[bool]]:
+    semaphore = asyncio.Semaphore(concurrency)
+    async def bounded_check(username: str):
+        async with semaphore:
+            return username, await check_username_exists(username, client)
+    return dict(await asyncio.gather(*(bounded_check(username) for username in usernames)))
+
 @router.get("/view_unfulfilled", response_class=HTMLResponse)
 async def view_unfulfilled_registrations(request: Request, auth_token: str = Depends(verify_admin_auth)):
-    registrations = load_registrations()
+    registrations = cached_registrations()
     unfulfilled = []
     if registrations:
-        current_time = datetime.utcnow()
-        async with httpx.AsyncClient() as client:
-            for entry in registrations:
-                username = entry["requested_name"]
-                reg_date = datetime.fromisoformat(entry["datetime"])
-                age = current_time - reg_date
-                url = f"{config['base_url']}/_matrix/client/v3/register/available?username={username}"
-                try:
-                    response = await client.get(url, timeout=5)
-                    if response.status_code == 200 and response.json().get("available", False):
-                        unfulfilled.append({
-                            "username": username,
-                            "email": entry["email"],
-                            "registration_date": entry["datetime"],
-                            "age_hours": age.total_seconds() / 3600
-                        })
-                except httpx.RequestError as ex:
-                    logger.error(f"Error checking username {username}: {ex}")
+        now = int(time.time())
+        exists_by_name = await check_usernames_exist({entry["requested_name"] for entry in registrations}, get_http_client())
+        for entry in registrations:
+            username = entry["requested_name"]
+            if exists_by_name[username] is False:
+                unfulfilled.append({
+                    "username": username,
+                    "email": entry["email"],
+                    "registration_date": entry["datetime"],
+                    "age_hours": (now - entry["ts"]) / 3600
+                })
     return templates.TemplateResponse("unfulfilled_registrations.html", {"request": request, "registrations": unfulfilled})
 
 @router.post("/purge_unfulfilled_registrations", response_class=JSONResponse)
 async def purge_unfulfilled_registrations(min_age_hours: int = Form(default=24), auth_token: str = Depends(verify_admin_auth)):
-    registrations = load_registrations()
+    now = int(time.time())
+    min_age = min_age_hours * 3600
+    # Decide from one snapshot; registrations that arrive while the lookups run are
+    # not in it and survive the rewrite below.
+    registrations = cached_registrations()
     if not registrations:
         return JSONResponse({"message": "No registrations found to clean up"})
     logger.info(f"Starting cleanup of {len(registrations)} registrations")
     logger.info(f"Will remove non-existent users registered more than {min_age_hours} hours ago")
-    entries_to_keep = []
-    removed_count = 0
+    # Recent entries are kept regardless, so only older names need a homeserver lookup
+    candidates = {entry["requested_name"] for entry in registrations if now - entry["ts"] >= min_age}
+    entries_to_remove = []
     too_new_count = 0
     exists_count = 0
-    current_time = datetime.utcnow()
-    async with httpx.AsyncClient() as client:
-        for entry in registrations:
-            username = entry["requested_name"]
-            reg_date = datetime.fromisoformat(entry["datetime"])
-            age = current_time - reg_date
-            url = f"{config['base_url']}/_matrix/client/v3/register/available?username={username}"
-            try:
-                response = await client.get(url, timeout=5)
-                if response.status_code == 200 and response.json().get("available", False):
-                    exists = False
-                elif response.status_code == 400 or (response.status_code == 200 and not response.json().get("available", False)):
-                    exists = True
-                else:
-                    logger.warning(f"Unexpected response for {username}: {response.status_code}")
-                    exists = False
-            except httpx.RequestError as ex:
-                logger.error(f"Error checking username {username}: {ex}")
-                exists = False
-            if exists:
-                entries_to_keep.append(entry)
-                exists_count += 1
-                logger.info(f"Keeping registration for existing user: {username}")
-                continue
-            if age < timedelta(hours=min_age_hours):
-                entries_to_keep.append(entry)
-                too_new_count += 1
-                logger.info(f"Keeping recent registration: {username} (age: {age.total_seconds()/3600:.1f} hours)")
-            else:
-                logger.info(f"Removing old registration: {username} (age: {age.total_seconds()/3600:.1f} hours)")
-                removed_count += 1
-    save_registrations(entries_to_keep)
+    unverified_count = 0
+    exists_by_name = await check_usernames_exist(candidates, get_http_client())
+    for entry in registrations:
+        username = entry["requested_name"]
+        age = now - entry["ts"]
+        exists = exists_by_name.get(username)
+        if age < min_age:
+            too_new_count += 1
+            logger.info(f"Keeping recent registration: {username} (age: {age/3600:.1f} hours)")
+        elif exists:
+            exists_count += 1
+            logger.info(f"Keeping registration for existing user: {username}")
+        elif exists is None:
+            # The lookup failed, so the account may well exist; keep it for a later purge
+            unverified_count += 1
+            logger.warning(f"Keeping registration that could not be checked: {username}")
+        else:
+            logger.info(f"Removing old registration: {username} (age: {age/3600:.1f} hours)")
+            entries_to_remove.append(entry)
+    remaining = remove_registrations(entries_to_remove)
     result = {
         "message": "Cleanup complete",
         "kept_existing": exists_count,
         "kept_recent": too_new_count,
-        "removed": removed_count,
-        "total_remaining": len(entries_to_keep)
+        "kept_unverified": unverified_count,
+        "removed": len(entries_to_remove),
+        "total_remaining": len(remaining)
     }
     logger.info(f"Cleanup complete: {result}")
     return JSONResponse(result)
 
+HOMESERVER = config["homeserver"].lower()  # Server part of local user IDs, for case-insensitive matching
+
+def _local_users(matrix_users) -> Iterator[Tuple[str, str]]:
+    """Yield (lowercased localpart, user ID) for each user on this homeserver."""
+    for user in matrix_users:
+        lowered = user.lower()
+        if lowered[:1] != "@":
+            continue
+        username, _, user_homeserver = lowered[1:].partition(":")
+        if user_homeserver == HOMESERVER:
+            yield username, user
+
 @router.get("/view_undocumented", response_class=HTMLResponse)
 async def view_undocumented_users(request: Request, auth_token: str = Depends(verify_admin_auth)):
-    registrations = load_registrations()
     matrix_users = await get_matrix_users()
-    registered_usernames = {entry["requested_name"].lower() for entry in registrations}
-    homeserver = config["homeserver"].lower()
-    undocumented_users = [
-        user for user in matrix_users
-        if user.lower().startswith("@") and user[1:].lower().split(":", 1)[1] == homeserver
-        and user[1:].lower().split(":", 1)[0] not in registered_usernames
-    ]
+    registered_usernames = requested_usernames()
+    undocumented_users = [user for username, user in _local_users(matrix_users) if username not in registered_usernames]
     return templates.TemplateResponse("undocumented_users.html", {"request": request, "users": undocumented_users})
 
 @router.post("/deactivate_undocumented_users", response_class=JSONResponse)
 async def deactivate_undocumented_users(auth_token: str = Depends(verify_admin_auth)):
-    registrations = load_registrations()
     matrix_users = await get_matrix_users()
-    registered_usernames = {entry["requested_name"].lower() for entry in registrations}
-    homeserver = config["homeserver"].lower()
-    undocumented_users = [
-        user for user in matrix_users
-        if user.lower().startswith("@") and user[1:].lower().split(":", 1)[1] == homeserver
-        and user[1:].lower().split(":", 1)[0] not in registered_usernames
-    ]
+    registered_usernames = requested_usernames()
+    undocumented_users = [user for username, user in _local_users(matrix_users) if username not in registered_usernames]
     if not undocumented_users:
         logger.info("No undocumented users found to deactivate")
         return JSONResponse({"message": "No undocumented users found to deactivate", "deactivated_count": 0})
-    deactivated_count = 0
-    failed_deactivations = []
-    for user in undocumented_users:
-        success = await deactivate_user(user)
-        if success:
-            deactivated_count += 1
-        else:
-            failed_deactivations.append(user)
+    results = await deactivate_users(undocumented_users)
+    failed_deactivations = [user for user, success in results.items() if not success]
+    deactivated_count = len(results) - len(failed_deactivations)
     logger.info(f"Deactivated {deactivated_count} undocumented users")
     if failed_deactivations:
         logger.warning(f"Failed to deactivate {len(failed_deactivations)} users: {failed_deactivations}")
@@ -176,19 +184,15 @@ async def deactivate_undocumented_users(auth_token: str = Depends(verify_admin_a
 async def retroactively_document_users(auth_token: str = Depends(verify_admin_auth)):
     registrations = load_registrations()
     matrix_users = await get_matrix_users()
-    registered_usernames = {entry["requested_name"].lower() for entry in registrations}
-    homeserver = config["homeserver"].lower()
+    registered_usernames = set(requested_usernames())
     added_count = 0
-    for user in matrix_users:
-        if not user.lower().startswith("@"):
-            continue
-        username, user_homeserver = user[1:].lower().split(":", 1)
-        if user_homeserver != homeserver or username in registered_usernames:
+    for username, user in _local_users(matrix_users):
+        if username in registered_usernames:
             continue
         new_entry = {
             "requested_name": username,
             "email": "null@nope.no",
-            "datetime": datetime.utcnow().isoformat(),
+            "datetime": get_current_utc().isoformat(),
             "ip_address": "127.0.0.1"
         }
         registrations.append(new_entry)
@@ -240,10 +244,13 @@ async def moderate_rooms(auth_token: str = Depends(verify_admin_auth)):
 # Helper functions for streaming endpoint
 def parse_rooms_response(response: str) -> list:
     """Parse rooms from admin bot response."""
-    room_pattern = r"(!\S+)\s+Members: (\d+)\s+Name: (.*)"
+    match_line = ROOM_LINE_PATTERN.match
     rooms = []
     for line in response.split('\n'):
-        match = re.match(room_pattern, line)
+        # Only room lines start with a room ID; skip the regex for everything else
+        if not line.startswith('!'):
+            continue
+        match = match_line(line)
         if match:
             rooms.append({
                 'room_id': match.group(1),
@@ -254,10 +261,12 @@ def parse_rooms_response(response: str) -> list:
 
 def parse_members_response(response: str) -> list:
     """Parse members from admin bot response."""
-    member_pattern = r"(@\S+)\s*\|\s*(\S+)"
+    match_line = MEMBER_LINE_PATTERN.match
     members = []
     for line in response.split('\n'):
-        match = re.match(member_pattern, line)
+        if not line.startswith('@'):
+            continue
+        match = match_line(line)
         if match:
             members.append({
                 'user_id': match.group(1),
@@ -313,7 +322,7 @@ async def moderate_rooms_stream(auth_token: str = Depends(verify_admin_auth)):
                                     'room_name': room['name'],
                                     'total_members': room['members'],
                                     'matched_pattern': matched_pattern,
-                                    'timestamp': datetime.utcnow().isoformat()
+                                    'timestamp': get_current_utc().isoformat()
                                 },
                                 'total_found': total_banned
                             })}\n\n"
@@ -1,8 +1,11 @@
 import os
+import re
+import html
 import subprocess
 import requests
 import feedparser
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 from fastapi import APIRouter, Request, Form, Depends, HTTPException
 from fastapi.responses import HTMLResponse, JSONResponse
@@ -18,7 +21,24 @@ templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
 
 ATTESTATIONS_FILE = os.path.join(BASE_DIR, "config", "attestations.txt")
 CANARY_OUTPUT_FILE = os.path.join(BASE_DIR, "data", "canary.txt")
-TEMP_CANARY_FILE = os.path.join(BASE_DIR, "data", "temp_canary_message.txt")
+
+# Fixed for the life of the process, so read them from config once
+CANARY_CONFIG = config['canary']
+ORGANIZATION = CANARY_CONFIG['organization']
+ADMIN_NAME = CANARY_CONFIG.get('admin_name', 'Admin')
+ADMIN_TITLE = CANARY_CONFIG.get('admin_title', 'administrator')
+RSS_URL = CANARY_CONFIG.get('rss', {}).get('url', 'https://www.democracynow.org/democracynow.rss')
+
+# Shared across all canary fetches so repeat requests reuse pooled keep-alive connections
+SESSION = requests.Session()
+SESSION.headers.update({"User-Agent": "sw1tch-canary/1.0"})
+_adapter = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=4,
+    max_retries=Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
+)
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
 
 def load_attestations():
     try:
@@ -28,17 +48,13 @@ def load_attestations():
         raise HTTPException(status_code=500, detail=f"Attestations file not found: {ATTESTATIONS_FILE}")
 
 def get_nist_time():
-    session = requests.Session()
-    retry_strategy = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("https://", adapter)
     endpoints = [
         "https://timeapi.io/api/Time/current/zone?timeZone=UTC",
         "https://worldtimeapi.org/api/timezone/UTC",
     ]
     for url in endpoints:
         try:
-            response = session.get(url, timeout=10)
+            response = SESSION.get(url, timeout=10)
             response.raise_for_status()
             data = response.json()
             if "dateTime" in data:
@@ -49,62 +65,99 @@ def get_nist_time():
             logger.error(f"Failed to fetch NIST time from {url}: {e}")
     raise HTTPException(status_code=500, detail="Failed to fetch NIST time")
 
+RSS_ITEM_PATTERN = re.compile(rb"<item[\s>].*?</item>", re.S)
+RSS_TITLE_PATTERN = re.compile(rb"<title[^>]*>\s*(?:<!\[CDATA\[)?(.*?)(?:\]\]>)?\s*</title>", re.S)
+RSS_LINK_PATTERN = re.compile(rb"<link[^>]*>\s*(?:<!\[CDATA\[)?(.*?)(?:\]\]>)?\s*</link>", re.S)
+RSS_SCAN_LIMIT = 65536
+
+def _stream_first_rss_item(rss_url: str):
+    """Read the feed only until its first <item> is complete and pull title/link out of it."""
+    with SESSION.get(rss_url, stream=True, timeout=10) as response:
+        response.raise_for_status()
+        buf = b""
+        for chunk in response.iter_content(4096):
+            buf += chunk
+            item = RSS_ITEM_PATTERN.search(buf)
+            if item:
+                title = RSS_TITLE_PATTERN.search(item.group(0))
+                link = RSS_LINK_PATTERN.search(item.group(0))
+                if title and link:
+                    return {
+                        "title": html.unescape(title.group(1).decode("utf-8", "replace")),
+                        "link": html.unescape(link.group(1).decode("utf-8", "replace"))
+                    }
+                return None
+            if len(buf) > RSS_SCAN_LIMIT:
+                return None
+    return None
+
 def get_rss_headline():
-    rss_config = config['canary'].get('rss', {})
-    rss_url = rss_config.get('url', 'https://www.democracynow.org/democracynow.rss')
+    rss_url = RSS_URL
+    try:
+        headline = _stream_first_rss_item(rss_url)
+        if headline:
+            return headline
+    except requests.RequestException as e:
+        logger.error(f"Failed to stream RSS feed {rss_url}: {e}")
+    # Atom feeds and anything the fast path cannot read go through feedparser
     feed = feedparser.parse(rss_url)
     if feed.entries and len(feed.entries) > 0:
         return {"title": feed.entries[0].title, "link": feed.entries[0].link}
     raise HTTPException(status_code=500, detail="Failed to fetch RSS headline")
 
 def get_bitcoin_latest_block():
-    try:
-        response = requests.get("https://blockchain.info/latestblock", timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        block_response = requests.get(f"https://blockchain.info/rawblock/{data['hash']}", timeout=10)
-        block_response.raise_for_status()
-        block_data = block_response.json()
-        hash_str = data["hash"].lstrip("0") or "0"
-        return {
-            "height": data["height"],
-            "hash": hash_str,
-            "time": datetime.datetime.fromtimestamp(block_data["time"]).strftime("%Y-%m-%d %H:%M:%S UTC")
-        }
-    except requests.RequestException as e:
-        logger.error(f"Failed to fetch Bitcoin block data: {e}")
-        raise HTTPException(status_code=500, detail="Failed to fetch Bitcoin block data")
+    # Each source returns height, hash and timestamp of the tip in a single response
+    sources = [
+        ("https://blockstream.info/api/blocks", lambda data: data[0], "id", "timestamp"),
+        ("https://blockchain.info/latestblock", lambda data: data, "hash", "time"),
+    ]
+    for url, pick, hash_key, time_key in sources:
+        try:
+            response = SESSION.get(url, timeout=10)
+            response.raise_for_status()
+            block = pick(response.json())
+            hash_str = block[hash_key].lstrip("0") or "0"
+            return {
+                "height": block["height"],
+                "hash": hash_str,
+                "time": datetime.datetime.fromtimestamp(block[time_key], datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
+            }
+        except (requests.RequestException, KeyError, IndexError, ValueError) as e:
+            logger.error(f"Failed to fetch Bitcoin block data from {url}: {e}")
+    raise HTTPException(status_code=500, detail="Failed to fetch Bitcoin block data")
 
 def create_warrant_canary_message(attestations: List[str], note: str):
-    nist_time = get_nist_time()
-    rss_data = get_rss_headline()
-    bitcoin_block = get_bitcoin_latest_block()
-    org = config['canary']['organization']
-    admin_name = config['canary'].get('admin_name', 'Admin')
-    admin_title = config['canary'].get('admin_title', 'administrator')
-    message = f"{org} Warrant Canary · {nist_time}\n"
-    message += f"I, {admin_name}, the {admin_title} of {org}, state this {datetime.datetime.now().strftime('%dth day of %B, %Y')}:\n"
-    for i, attestation in enumerate(attestations, 1):
-        message += f"  {i}. {org} {attestation}\n"
+    # The three sources are independent, so wait for the slowest rather than their sum
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        nist_future = executor.submit(get_nist_time)
+        rss_future = executor.submit(get_rss_headline)
+        bitcoin_future = executor.submit(get_bitcoin_latest_block)
+        nist_time, rss_data, bitcoin_block = nist_future.result(), rss_future.result(), bitcoin_future.result()
+    org, admin_name, admin_title = ORGANIZATION, ADMIN_NAME, ADMIN_TITLE
+    lines = [
+        f"{org} Warrant Canary · {nist_time}",
+        f"I, {admin_name}, the {admin_title} of {org}, state this {datetime.datetime.now().strftime('%dth day of %B, %Y')}:",
+    ]
+    lines.extend(f"  {i}. {org} {attestation}" for i, attestation in enumerate(attestations, 1))
     if note:
-        message += f"\nNOTE: {note}\n"
-    message += "\nDatestamp Proof:\n"
-    message += f"  Daily News:  \"{rss_data['title']}\"\n"
-    message += f"  Source URL:  {rss_data['link']}\n"
-    message += f"  BTC block:   #{bitcoin_block['height']}, {bitcoin_block['time']}\n"
-    message += f"  Block hash:  {bitcoin_block['hash']}\n"
-    return message.rstrip() + "\n"
+        lines += ["", f"NOTE: {note}"]
+    lines += [
+        "",
+        "Datestamp Proof:",
+        f"  Daily News:  \"{rss_data['title']}\"",
+        f"  Source URL:  {rss_data['link']}",
+        f"  BTC block:   #{bitcoin_block['height']}, {bitcoin_block['time']}",
+        f"  Block hash:  {bitcoin_block['hash']}",
+    ]
+    return "\n".join(lines).rstrip() + "\n"
 
 def sign_with_gpg(message: str, gpg_key_id: str, passphrase: str):
     try:
-        with open(TEMP_CANARY_FILE, "w", newline='\n') as f:
-            f.write(message)
-        cmd = ["gpg", "--batch", "--yes", "--passphrase", passphrase, "--clearsign", "--default-key", gpg_key_id, TEMP_CANARY_FILE]
-        subprocess.run(cmd, check=True, capture_output=True, text=True)
-        with open(f"{TEMP_CANARY_FILE}.asc", "r") as f:
-            signed_message = f.read()
-        os.remove(TEMP_CANARY_FILE)
-        os.remove(f"{TEMP_CANARY_FILE}.asc")
+        # Message goes in on stdin and the clearsigned text comes back on stdout,
+        # so the unsigned canary is never written to disk
+        cmd = ["gpg", "--batch", "--yes", "--passphrase", passphrase, "--clearsign", "--default-key", gpg_key_id]
+        result = subprocess.run(cmd, input=message, check=True, capture_output=True, text=True)
+        signed_message = result.stdout
         lines = signed_message.splitlines()
         signature_idx = next(i for i, line in enumerate(lines) if line == "-----BEGIN PGP SIGNATURE-----")
         if lines[signature_idx + 1] == "":
@@ -119,11 +172,11 @@ def sign_with_gpg(message: str, gpg_key_id: str, passphrase: str):
 
 async def post_to_matrix(signed_message: str):
     try:
-        matrix = config['canary']['credentials']
+        matrix = CANARY_CONFIG['credentials']
         client = AsyncClient(config['base_url'], matrix['username'])
         await client.login(matrix['password'])
         full_message = (
-            f"This is the {config['canary']['organization']} Warrant Canary, signed with GPG for authenticity. "
+            f"This is the {ORGANIZATION} Warrant Canary, signed with GPG for authenticity. "
             "Copy the code block below to verify with `gpg --verify`:\n\n"
             f"```\n{signed_message}\n```"
         )
@@ -132,12 +185,12 @@ async def post_to_matrix(signed_message: str):
             "body": full_message,
             "format": "org.matrix.custom.html",
             "formatted_body": (
-                f"This is the {config['canary']['organization']} Warrant Canary, signed with GPG for authenticity. "
+                f"This is the {ORGANIZATION} Warrant Canary, signed with GPG for authenticity. "
                 "Copy the code block below to verify with <code>gpg --verify</code>:<br><br>"
                 f"<pre>{signed_message}</pre>"
             )
         }
-        await client.room_send(config['canary']['room'], "m.room.message", content)
+        await client.room_send(CANARY_CONFIG['room'], "m.room.message", content)
         await client.logout()
         await client.close()
         logger.info("Warrant canary posted to Matrix successfully")
@@ -152,7 +205,7 @@ async def warrant_canary_form(request: Request, auth_token: str = Depends(verify
     return templates.TemplateResponse("canary.html", {
         "request": request,
         "attestations": attestations,
-        "organization": config["canary"]["organization"]
+        "organization": ORGANIZATION
     })
 
 @router.post("/preview", response_class=HTMLResponse)
@@ -177,7 +230,7 @@ async def warrant_canary_sign(
     passphrase: str = Form(...),
     auth_token: str = Depends(verify_admin_auth)
 ):
-    signed_message = sign_with_gpg(message, config["canary"]["gpg_key_id"], passphrase)
+    signed_message = sign_with_gpg(message, CANARY_CONFIG["gpg_key_id"], passphrase)
     with open(CANARY_OUTPUT_FILE, "w") as f:
         f.write(signed_message)
     logger.info(f"Warrant canary saved to {CANARY_OUTPUT_FILE}")
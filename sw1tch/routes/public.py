@@ -1,38 +1,45 @@
 import os
-from datetime import datetime as datetime
+import time
 from fastapi import APIRouter, Request, Form
 from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
 
 from sw1tch import BASE_DIR, config, logger, read_registration_token
-from sw1tch.utilities.time import get_current_utc, is_registration_closed
+from sw1tch.utilities.time import get_current_utc, is_registration_closed, RESET_HOUR, RESET_MINUTE
 from sw1tch.utilities.registration import check_email_cooldown, check_username_availability, build_email_message, send_email_message
 from sw1tch import save_registration, is_ip_banned, is_email_banned
 
 router = APIRouter()
 templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
 
+# Rendered homepage for the latest (closed, message) pair; the message changes at most once a minute
+_index_cache = [None, ""]
+
 @router.get("/", response_class=HTMLResponse)
 async def index(request: Request):
     now = get_current_utc()
     closed, message = is_registration_closed(now)
-    return templates.TemplateResponse(
-        "index.html",
-        {
-            "request": request,
-            "registration_closed": closed,
-            "homeserver": config["homeserver"],
-            "message": message,
-            "reset_hour": config["registration"]["token_reset_time_utc"] // 100,
-            "reset_minute": config["registration"]["token_reset_time_utc"] % 100,
-            "downtime_minutes": config["registration"]["downtime_before_token_reset"]
-        }
-    )
+    if _index_cache[0] != (closed, message):
+        html = templates.get_template("index.html").render(
+            registration_closed=closed,
+            homeserver=config["homeserver"],
+            message=message,
+            reset_hour=RESET_HOUR,
+            reset_minute=RESET_MINUTE,
+            downtime_minutes=config["registration"]["downtime_before_token_reset"]
+        )
+        _index_cache[0], _index_cache[1] = (closed, message), html
+    return HTMLResponse(_index_cache[1])
+
+# The homepage clock polls /api/time; the formatted value only changes once a second
+_server_time = [None, ""]
 
 @router.get("/api/time")
 async def get_server_time():
-    now = get_current_utc()
-    return JSONResponse({"utc_time": now.strftime("%H:%M:%S")})
+    second = int(time.time())
+    if _server_time[0] != second:
+        _server_time[0], _server_time[1] = second, time.strftime("%H:%M:%S", time.gmtime(second))
+    return JSONResponse({"utc_time": _server_time[1]})
 
 @router.post("/register", response_class=HTMLResponse)
 async def register(request: Request, requested_username: str = Form(...), email: str = Form(...)):
@@ -61,11 +68,12 @@ async def register(request: Request, requested_username: str = Form(...), email:
         logger.error("Registration token file not found")
         raise HTTPException(status_code=500, detail="Registration token file not found.")
     email_message = build_email_message(token, requested_username, now, email)
-    send_email_message(email_message)
+    await send_email_message(email_message)
     registration_data = {
         "requested_name": requested_username,
         "email": email,
-        "datetime": datetime.utcnow().isoformat(),
+        "datetime": now.isoformat(),
+        "ts": int(time.time()),
         "ip_address": client_ip
     }
     save_registration(registration_data)
@@ -7,6 +7,10 @@ from nio import AsyncClient, RoomMessageText, RoomMessageNotice
 
 from sw1tch import config, logger
 
+ROOM_LINE_PATTERN = re.compile(r"(!\S+)\s+Members: (\d+)\s+Name: (.*)")
+MEMBER_LINE_PATTERN = re.compile(r"(@\S+)\s*\|\s*(\S+)")
+MEMBER_COUNT_PATTERN = re.compile(r"(\d+) Members in Room \"(.*)\":")
+
 # Persistent Matrix Bot with improved connection handling
 class PersistentMatrixBot:
     def __init__(self):
@@ -172,14 +176,25 @@ class PersistentMatrixBot:
 matrix_bot = PersistentMatrixBot()
 
 def parse_response(response_text: str, query: str) -> Dict[str, Union[str, List[str]]]:
+    """Split an admin bot reply ("<message>:" followed by a ``` code block) into message and items.
+
+    Scans with str.find rather than a backtracking regex, since replies can run to thousands of lines.
+    """
     query_parts = query.strip().split()
     array_key = query_parts[0] if query_parts else "data"
-    codeblock_pattern = r"(.*?):\s*\n```\s*\n([\s\S]*?)\n```"
-    match = re.search(codeblock_pattern, response_text)
-    if match:
-        message = match.group(1).strip()
-        items = [line for line in match.group(2).split('\n') if line.strip()]
-        return {"message": message, array_key: items}
+    fence = response_text.find("\n```")
+    while fence != -1:
+        head = response_text[:fence].rstrip()
+        body_start = response_text.find("\n", fence + 4)
+        # The opening fence must follow a line ending in ":" and have nothing else on its line
+        if head.endswith(":") and body_start != -1 and not response_text[fence + 4:body_start].strip():
+            body_end = response_text.find("\n```", body_start)
+            if body_end == -1:
+                break
+            message = head[head.rfind("\n") + 1:-1].strip()
+            items = [line for line in response_text[body_start + 1:body_end].split('\n') if line.strip()]
+            return {"message": message, array_key: items}
+        fence = response_text.find("\n```", fence + 4)
     return {"response": response_text}
 
 async def get_matrix_users() -> List[str]:
@@ -198,8 +213,19 @@ async def get_matrix_users() -> List[str]:
             raise Exception(f"Login error: {login_response.error}")
         logger.debug("Successfully logged in to Matrix")
         await client.join(admin_room)
-        initial_sync = await client.sync(timeout=5000)
-        next_batch = initial_sync.next_batch
+        await client.sync(timeout=5000)
+        response_message = None
+        received = asyncio.Event()
+        # nio calls this for each new message as syncs arrive, so the wait ends as soon as
+        # the reply lands instead of on the next poll
+        async def on_message(room, event):
+            nonlocal response_message
+            if (response_message is None and room.room_id == admin_room
+                    and event.sender == admin_response_user and event.server_timestamp / 1000.0 >= query_time):
+                response_message = event.body
+                logger.debug(f"Found response: {response_message[:100]}...")
+                received.set()
+        client.add_event_callback(on_message, (RoomMessageText, RoomMessageNotice))
         await client.room_send(
             room_id=admin_room,
             message_type="m.room.message",
@@ -207,22 +233,14 @@ async def get_matrix_users() -> List[str]:
         )
         query_time = time.time()
         timeout_seconds = 10
-        start_time = time.time()
-        response_message = None
-        while (time.time() - start_time) < timeout_seconds:
-            sync_response = await client.sync(timeout=2000, since=next_batch)
-            next_batch = sync_response.next_batch
-            room = sync_response.rooms.join.get(admin_room)
-            if room and room.timeline and room.timeline.events:
-                message_events = [e for e in room.timeline.events if isinstance(e, (RoomMessageText, RoomMessageNotice))]
-                for event in message_events:
-                    event_time = event.server_timestamp / 1000.0
-                    if event.sender == admin_response_user and event_time >= query_time:
-                        response_message = event.body
-                        logger.debug(f"Found response: {response_message[:100]}...")
-                        break
-                if response_message:
-                    break
+        sync_task = asyncio.create_task(client.sync_forever(timeout=2000))
+        try:
+            await asyncio.wait_for(received.wait(), timeout=timeout_seconds)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            sync_task.cancel()
+            await asyncio.gather(sync_task, return_exceptions=True)
         await client.logout()
         await client.close()
         if not response_message:
@@ -234,7 +252,27 @@ async def get_matrix_users() -> List[str]:
         logger.error(f"Error fetching Matrix users: {e}")
         raise HTTPException(status_code=500, detail=f"Error fetching users: {e}")
 
-async def deactivate_user(user: str) -> bool:
+DEACTIVATE_CONCURRENCY = 8  # Deactivation commands in flight at once on the shared admin session
+
+async def _send_deactivation(client: AsyncClient, admin_room: str, user: str, semaphore: asyncio.Semaphore) -> bool:
+    async with semaphore:
+        try:
+            response = await client.room_send(
+                room_id=admin_room,
+                message_type="m.room.message",
+                content={"msgtype": "m.text", "body": f"!admin users deactivate {user}"},
+            )
+            if getattr(response, "error", None):
+                raise Exception(f"Send error: {response.error}")
+            logger.info(f"Sent deactivation command for {user}")
+            await asyncio.sleep(1)  # Holds the slot, capping commands at DEACTIVATE_CONCURRENCY per second
+            return True
+        except Exception as e:
+            logger.error(f"Failed to deactivate {user}: {e}")
+            return False
+
+async def deactivate_users(users: List[str]) -> Dict[str, bool]:
+    """Deactivate users over a single admin login; maps each user to whether its command was sent."""
     matrix_config = config["matrix_admin"]
     homeserver = config["base_url"]
     username = matrix_config.get("username")
@@ -245,24 +283,18 @@ async def deactivate_user(user: str) -> bool:
         login_response = await client.login(password)
         if getattr(login_response, "error", None):
             raise Exception(f"Login error: {login_response.error}")
-        logger.debug(f"Logged in to deactivate {user}")
+        logger.debug(f"Logged in to deactivate {len(users)} user(s)")
         await client.join(admin_room)
         await client.sync(timeout=5000)
-        command = f"!admin users deactivate {user}"
-        await client.room_send(
-            room_id=admin_room,
-            message_type="m.room.message",
-            content={"msgtype": "m.text", "body": command},
-        )
-        logger.info(f"Sent deactivation command for {user}")
-        await asyncio.sleep(1)
+        semaphore = asyncio.Semaphore(DEACTIVATE_CONCURRENCY)
+        results = await asyncio.gather(*(_send_deactivation(client, admin_room, user, semaphore) for user in users))
         await client.logout()
         await client.close()
-        return True
+        return dict(zip(users, results))
     except Exception as e:
         await client.close()
-        logger.error(f"Failed to deactivate {user}: {e}")
-        return False
+        logger.error(f"Failed to deactivate users: {e}")
+        return {user: False for user in users}
 
 async def get_matrix_rooms(page: int) -> List[Dict[str, Union[str, int]]]:
     matrix_config = config["matrix_admin"]
@@ -313,10 +345,9 @@ async def get_matrix_rooms(page: int) -> List[Dict[str, Union[str, int]]]:
         
         # Parse the response
         parsed = parse_response(response_message, "rooms list-rooms")
-        room_pattern = r"(!\S+)\s+Members: (\d+)\s+Name: (.*)"
         rooms = []
         for line in parsed.get("rooms", []):
-            match = re.match(room_pattern, line)
+            match = ROOM_LINE_PATTERN.match(line)
             if match:
                 room_id, members, name = match.groups()
                 rooms.append({
@@ -381,13 +412,12 @@ async def get_room_members(room_id: str, local_only: bool = False) -> Dict[str,
         
         # Parse the response
         parsed = parse_response(response_message, "members list-joined-members")
-        member_pattern = r"(@\S+)\s*\|\s*(\S+)"
         members = []
-        message_match = re.match(r"(\d+) Members in Room \"(.*)\":", parsed["message"])
+        message_match = MEMBER_COUNT_PATTERN.match(parsed["message"])
         total_members = int(message_match.group(1)) if message_match else 0
         room_name = message_match.group(2) if message_match else room_id
         for line in parsed.get("members", []):
-            match = re.match(member_pattern, line)
+            match = MEMBER_LINE_PATTERN.match(line)
             if match:
                 user_id, display_name = match.groups()
                 members.append({"user_id": user_id, "display_name": display_name})
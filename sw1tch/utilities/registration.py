@@ -1,92 +1,194 @@
 import os
+import time
+import asyncio
 import smtplib
 import httpx
 from datetime import datetime
 from email.message import EmailMessage
-from typing import Optional
+from string import Formatter
+from typing import Dict, List, Optional, Tuple
 from fastapi import HTTPException
 
-from sw1tch import config, BASE_DIR, load_registrations, save_registration, is_username_banned, logger
+try:
+    import aiosmtplib  # Optional; sends registration email natively on the event loop
+except ImportError:
+    aiosmtplib = None
+
+try:
+    import h2  # Optional; enables HTTP/2 to the homeserver
+except ImportError:
+    h2 = None
+
+from sw1tch import config, BASE_DIR, _cached_by_stat, latest_registration_ts, is_username_requested, is_username_banned, logger
+
+# Fixed for the life of the process, so read them from config once
+MULTIPLE_USERS_PER_EMAIL = config["registration"].get("multiple_users_per_email", True)
+EMAIL_COOLDOWN = config["registration"].get("email_cooldown")
+SMTP_CONFIG = config["email"]["smtp"]
+REGISTRATION_TEMPLATES = config["email"]["templates"]["registration_token"]
+
+HTTP_MAX_CONNECTIONS = 32  # Also bounds the admin panel's parallel availability lookups
+
+# Shared by registration and the admin panel so every homeserver request reuses
+# the same keep-alive connections (or one multiplexed HTTP/2 connection with h2)
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            base_url=config["base_url"],
+            timeout=5,
+            http2=h2 is not None,
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS)
+        )
+    return _http_client
+
+async def close_http_client() -> None:
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+AVAILABILITY_TTL = 60  # Seconds a homeserver availability answer is reused for repeat probes
+AVAILABILITY_CACHE_SIZE = 1024
+# username -> (time.monotonic() expiry, available), oldest insertion first
+_availability_cache: Dict[str, Tuple[float, bool]] = {}
+
+def _remember_availability(username: str, available: bool) -> bool:
+    _availability_cache.pop(username, None)
+    if len(_availability_cache) >= AVAILABILITY_CACHE_SIZE:
+        del _availability_cache[next(iter(_availability_cache))]
+    _availability_cache[username] = (time.monotonic() + AVAILABILITY_TTL, available)
+    return available
 
 async def check_username_availability(username: str) -> bool:
     if is_username_banned(username):
         logger.info(f"[USERNAME CHECK] {username}: Banned by pattern")
         return False
-    registrations = load_registrations()
-    if any(r["requested_name"] == username for r in registrations):
+    if is_username_requested(username):
         logger.info(f"[USERNAME CHECK] {username}: Already requested")
         return False
-    url = f"{config['base_url']}/_matrix/client/v3/register/available?username={username}"
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, timeout=5)
-            if response.status_code == 200:
-                is_available = response.json().get("available", False)
-                logger.info(f"[USERNAME CHECK] {username}: {'Available' if is_available else 'Taken'}")
-                return is_available
-            elif response.status_code == 400:
-                logger.info(f"[USERNAME CHECK] {username}: Taken (400)")
-                return False
-        except httpx.RequestError as ex:
-            logger.warning(f"[USERNAME CHECK] Could not reach homeserver: {ex}")
-            return False
+    cached = _availability_cache.get(username)
+    if cached is not None and cached[0] > time.monotonic():
+        logger.info(f"[USERNAME CHECK] {username}: {'Available' if cached[1] else 'Taken'} (cached)")
+        return cached[1]
+    try:
+        response = await get_http_client().get("/_matrix/client/v3/register/available", params={"username": username})
+        if response.status_code == 200:
+            is_available = response.json().get("available", False)
+            logger.info(f"[USERNAME CHECK] {username}: {'Available' if is_available else 'Taken'}")
+            return _remember_availability(username, is_available)
+        elif response.status_code == 400:
+            logger.info(f"[USERNAME CHECK] {username}: Taken (400)")
+            return _remember_availability(username, False)
+    except httpx.RequestError as ex:
+        logger.warning(f"[USERNAME CHECK] Could not reach homeserver: {ex}")
+        return False
     return False
 
 def check_email_cooldown(email: str) -> Optional[str]:
-    registrations = load_registrations()
-    email_entries = [r for r in registrations if r["email"] == email]
-    if not email_entries:
+    latest = latest_registration_ts(email)
+    if latest is None:
         return None
-    if not config["registration"].get("multiple_users_per_email", True):
+    if not MULTIPLE_USERS_PER_EMAIL:
         return "This email address has already been used to register an account."
-    email_cooldown = config["registration"].get("email_cooldown")
-    if email_cooldown:
-        latest = max(datetime.fromisoformat(e["datetime"]) for e in email_entries)
-        time_since = datetime.utcnow() - latest
-        if time_since.total_seconds() < email_cooldown:
-            wait_time = email_cooldown - time_since.total_seconds()
+    if EMAIL_COOLDOWN:
+        time_since = time.time() - latest
+        if time_since < EMAIL_COOLDOWN:
+            wait_time = EMAIL_COOLDOWN - time_since
             return f"Please wait {int(wait_time)} seconds before requesting another account."
     return None
 
-def load_template(template_path: str) -> str:
+_formatter = Formatter()
+
+def _format_field(value, spec: str, conversion: Optional[str]) -> str:
+    if conversion:
+        value = _formatter.convert_field(value, conversion)
+    return format(value, spec) if spec else str(value)
+
+def compile_template(template: str, **fixed) -> List[Tuple]:
+    """Split a str.format template into (literal, field, spec, conversion) pieces.
+
+    Fields given in ``fixed`` are substituted now and merged into the surrounding text,
+    so rendering only has to fill in the per-request fields.
+    """
+    pieces = []
+    literal = ""
+    for text, field, spec, conversion in _formatter.parse(template):
+        literal += text
+        if field is None:
+            continue
+        try:
+            value = _formatter.get_field(field, (), fixed)[0]
+        except KeyError:
+            pieces.append((literal, field, spec, conversion))
+            literal = ""
+        else:
+            literal += _format_field(value, spec, conversion)
+    pieces.append((literal, None, "", None))
+    return pieces
+
+def render_template(pieces: List[Tuple], values: Dict) -> str:
+    return "".join(
+        text + _format_field(_formatter.get_field(field, (), values)[0], spec, conversion) if field else text
+        for text, field, spec, conversion in pieces
+    )
+
+def _compile_template_file(path: str) -> List[Tuple]:
+    with open(path, "r") as f:
+        return compile_template(f.read(), homeserver=config["homeserver"])
+
+def load_compiled_template(template_path: str) -> List[Tuple]:
+    """Email template with {homeserver} already filled in; recompiled when the file changes."""
     try:
-        with open(os.path.join(BASE_DIR, template_path), "r") as f:
-            return f.read()
+        return _cached_by_stat(os.path.join(BASE_DIR, template_path), _compile_template_file)
     except FileNotFoundError:
         raise HTTPException(status_code=500, detail=f"Email template not found: {template_path}")
 
+REGISTRATION_SUBJECT = REGISTRATION_TEMPLATES["subject"].format(homeserver=config["homeserver"])
+
 def build_email_message(token: str, requested_username: str, now: datetime, recipient_email: str) -> EmailMessage:
     from sw1tch.utilities.time import get_time_until_reset_str
-    time_until_reset = get_time_until_reset_str(now)
-    plain_template = load_template(config["email"]["templates"]["registration_token"]["body"])
-    html_template = load_template(config["email"]["templates"]["registration_token"]["body_html"])
-    plain_body = plain_template.format(
-        homeserver=config["homeserver"], registration_token=token,
-        requested_username=requested_username, utc_time=now.strftime("%H:%M:%S"),
-        time_until_reset=time_until_reset
-    )
-    html_body = html_template.format(
-        homeserver=config["homeserver"], registration_token=token,
-        requested_username=requested_username, utc_time=now.strftime("%H:%M:%S"),
-        time_until_reset=time_until_reset
-    )
+    values = {
+        "registration_token": token,
+        "requested_username": requested_username,
+        "utc_time": now.strftime("%H:%M:%S"),
+        "time_until_reset": get_time_until_reset_str(now)
+    }
+    plain_body = render_template(load_compiled_template(REGISTRATION_TEMPLATES["body"]), values)
+    html_body = render_template(load_compiled_template(REGISTRATION_TEMPLATES["body_html"]), values)
     msg = EmailMessage()
     msg.set_content(plain_body)
     msg.add_alternative(html_body, subtype="html")
-    msg["Subject"] = config["email"]["templates"]["registration_token"]["subject"].format(homeserver=config["homeserver"])
-    msg["From"] = config["email"]["smtp"]["from"]
+    msg["Subject"] = REGISTRATION_SUBJECT
+    msg["From"] = SMTP_CONFIG["from"]
     msg["To"] = recipient_email
     return msg
 
-def send_email_message(msg: EmailMessage) -> None:
-    smtp_conf = config["email"]["smtp"]
+def _send_with_smtplib(msg: EmailMessage, smtp_conf: dict) -> None:
+    with smtplib.SMTP(smtp_conf["host"], smtp_conf["port"]) as server:
+        if smtp_conf.get("use_tls", True):
+            server.starttls()
+        server.login(smtp_conf["username"], smtp_conf["password"])
+        server.send_message(msg)
+
+async def send_email_message(msg: EmailMessage) -> None:
+    """Send without blocking the event loop: natively with aiosmtplib, else smtplib in a worker thread."""
+    smtp_conf = SMTP_CONFIG
     try:
-        with smtplib.SMTP(smtp_conf["host"], smtp_conf["port"]) as server:
-            if smtp_conf.get("use_tls", True):
-                server.starttls()
-            server.login(smtp_conf["username"], smtp_conf["password"])
-            server.send_message(msg)
-            logger.info(f"Registration email sent successfully to {msg['To']}")
+        if aiosmtplib:
+            await aiosmtplib.send(
+                msg,
+                hostname=smtp_conf["host"],
+                port=smtp_conf["port"],
+                start_tls=smtp_conf.get("use_tls", True),
+                username=smtp_conf["username"],
+                password=smtp_conf["password"]
+            )
+        else:
+            await asyncio.to_thread(_send_with_smtplib, msg, smtp_conf)
+        logger.info(f"Registration email sent successfully to {msg['To']}")
     except Exception as ex:
         logger.error(f"Failed to send email: {ex}")
         raise HTTPException(status_code=500, detail=f"Error sending email: {ex}")
@@ -1,24 +1,36 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from typing import Tuple
 
 from sw1tch import config
 
+# Fixed for the life of the process, so derive them from config once
+RESET_HOUR, RESET_MINUTE = divmod(config["registration"]["token_reset_time_utc"], 100)
+DOWNTIME = timedelta(minutes=config["registration"]["downtime_before_token_reset"])
+DAY_SECONDS = 86400
+RESET_SECOND_OF_DAY = (RESET_HOUR * 60 + RESET_MINUTE) * 60
+DOWNTIME_SECONDS = int(DOWNTIME.total_seconds())
+RESET_TIME_STR = f"{RESET_HOUR:02d}:{RESET_MINUTE:02d} UTC"
+DOWNTIME_START_STR = "{:02d}:{:02d} UTC".format(*divmod((RESET_SECOND_OF_DAY - DOWNTIME_SECONDS) % DAY_SECONDS // 60, 60))
+
 def get_current_utc() -> datetime:
-    return datetime.utcnow()
+    """Current UTC time as a naive datetime, matching the stored registration timestamps."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 def get_next_reset_time(now: datetime) -> datetime:
-    reset_h = config["registration"]["token_reset_time_utc"] // 100
-    reset_m = config["registration"]["token_reset_time_utc"] % 100
-    candidate = now.replace(hour=reset_h, minute=reset_m, second=0, microsecond=0)
+    candidate = now.replace(hour=RESET_HOUR, minute=RESET_MINUTE, second=0, microsecond=0)
     if candidate <= now:
         candidate += timedelta(days=1)
     return candidate
 
 def get_downtime_start(next_reset: datetime) -> datetime:
-    return next_reset - timedelta(minutes=config["registration"]["downtime_before_token_reset"])
+    return next_reset - DOWNTIME
 
 def format_timedelta(td: timedelta) -> str:
-    total_minutes = int(td.total_seconds() // 60)
+    return format_minutes(int(td.total_seconds() // 60))
+
+@lru_cache(maxsize=DAY_SECONDS // 60)  # Never more than a day's worth of distinct minute counts
+def format_minutes(total_minutes: int) -> str:
     hours = total_minutes // 60
     minutes = total_minutes % 60
     parts = []
@@ -38,16 +50,12 @@ def get_time_until_reset_str(now: datetime) -> str:
     return format_timedelta(delta)
 
 def is_registration_closed(now: datetime) -> Tuple[bool, str]:
-    nr = get_next_reset_time(now)
-    ds = get_downtime_start(nr)
-    if ds <= now < nr:
-        time_until_open = nr - now
-        msg = f"Registration is closed. It reopens in {format_timedelta(time_until_open)} at {nr.strftime('%H:%M UTC')}."
+    # Plain seconds-of-day arithmetic; registration closes DOWNTIME before each daily reset
+    second_of_day = now.hour * 3600 + now.minute * 60 + now.second + now.microsecond / 1e6
+    until_reset = (RESET_SECOND_OF_DAY - second_of_day) % DAY_SECONDS or DAY_SECONDS
+    if until_reset <= DOWNTIME_SECONDS:
+        msg = f"Registration is closed. It reopens in {format_minutes(int(until_reset // 60))} at {RESET_TIME_STR}."
         return True, msg
-    else:
-        if now > ds:
-            nr += timedelta(days=1)
-            ds = get_downtime_start(nr)
-        time_until_close = ds - now
-        msg = f"Registration is open. It will close in {format_timedelta(time_until_close)} at {ds.strftime('%H:%M UTC')}."
-        return False, msg
+    until_close = until_reset - DOWNTIME_SECONDS
+    msg = f"Registration is open. It will close in {format_minutes(int(until_close // 60))} at {DOWNTIME_START_STR}."
+    return False, msg
@@ -0,0 +1,31 @@
+import pytest
+
+try:
+    import sw1tch
+except FileNotFoundError:  # sw1tch reads sw1tch/config/config.yaml at import
+    pytest.skip("sw1tch/config/config.yaml is required to import sw1tch", allow_module_level=True)
+
+
+@pytest.fixture
+def banned_usernames(tmp_path, monkeypatch):
+    def write(*lines):
+        path = tmp_path / "banned_usernames.txt"
+        path.write_text("\n".join(lines) + "\n")
+        monkeypatch.setattr(sw1tch, "BANNED_USERNAMES_PATH", str(path))
+    return write
+
+
+def test_backreference_pattern_still_bans_when_combined(banned_usernames):
+    banned_usernames("^admin.+$", "bot[0-9]+", r"foo(\d)\1", r"(ab)\1x")
+    assert sw1tch.is_username_banned("foo11")
+    assert sw1tch.is_username_banned("ababx")
+    assert not sw1tch.is_username_banned("foo12")
+    assert sw1tch.is_username_banned("bot42")
+    assert sw1tch.is_username_banned("administrator")
+
+
+def test_group_free_patterns_are_combined(banned_usernames):
+    banned_usernames("^admin.+$", "bot[0-9]+", r"foo(\d)\1")
+    patterns = sw1tch.load_banned_usernames()["patterns"]
+    assert len(patterns) == 2
+    assert [p.groups for p in patterns] == [0, 1]